@@ -1,18 +1,30 @@
-from flask import Flask, jsonify, request, render_template, abort
+from flask import Flask, jsonify, request, render_template, abort, make_response, Response, stream_with_context
 import json
 from character import *
 from engine import *
 from arena import *
+from manager import *
+from transfer import *
+import os
 from http import *
 import http.client
 import threading
 import requests
 import random
 from prometheus_client import Counter, Gauge, Histogram, generate_latest
+from metrics import *
 import prometheus_client
 from prometheus_flask_exporter import PrometheusMetrics
 from threading import Lock
+from logger import getLogger
 
+log = getLogger("api")
+
+# Créés au démarrage (voir en bas du fichier)
+manager = None
+engine = None
+# Transferts de personnages reçus des autres serveurs
+transfers = TransferLedger()
 
 app = Flask(__name__)
 
@@ -25,13 +37,12 @@ def index():
 # Créer des métriques
 total_characters = Counter('total_characters', 'Nombre total de personnages ajoutés')
 active_games = Gauge('active_games', 'Nombre de jeux actifs')
-turn_duration = Histogram('turn_duration', 'Durée des tours', buckets=[0.1, 0.5, 1, 2, 5, 10])
+# Durée des tours et de leurs phases, nombre d'actions par tour
+turn_metrics = TurnMetrics()
 
-# Metrics pour les personnages
-character_life = Gauge('character_life', 'Vie des personnages', ['cid', 'teamid'])
-character_strength = Gauge('character_strength', 'Force des personnages', ['cid', 'teamid'])
-character_armor = Gauge('character_armor', 'Armure des personnages', ['cid', 'teamid'])
-character_speed = Gauge('character_speed', 'Vitesse des personnages', ['cid', 'teamid'])
+# Metrics pour les personnages, mises à jour par les événements du jeu :
+# une série par personnage ("cid") ou un histogramme par équipe ("team")
+character_metrics = CharacterMetrics(os.environ.get("ARENA_CHARACTER_METRICS", "cid"))
 
 # Initialiser PrometheusMetrics
 metrics = PrometheusMetrics(app)
@@ -43,37 +54,137 @@ metrics.register_default(
 
 @app.route('/metrics')
 def metrics_endpoint():
-    update_character_metrics()
     """Exposer les métriques Prometheus."""
     return generate_latest(), 200, {'Content-Type': 'text/plain; charset=utf-8'}
 
 # --------------------------------- Utility Functions -------------------------
-def update_character_metrics():
-    """Met à jour les métriques des personnages, et ignore celles des personnages morts."""
-    active_characters = engine._arena._playersList  # Liste des personnages actifs
+def get_arena_id():
+    """Arène visée par la requête : paramètre `arena` ou champ JSON `arena_id`, "default" sinon."""
+    arena_id = request.args.get("arena")
+    if arena_id is None:
+        data = request.get_json(silent=True)
+        if isinstance(data, dict):
+            arena_id = data.get("arena_id")
+    return arena_id if arena_id is not None else "default"
+
+def get_engine():
+    """Moteur de l'arène visée par la requête, 404 si elle n'existe pas."""
+    if manager is None:
+        return engine
+    arena_engine = manager.getArena(get_arena_id())
+    if arena_engine is None:
+        abort(make_response(jsonify({"error": f"Arène '{get_arena_id()}' introuvable."}), 404))
+    return arena_engine
+
+def new_arena(arena_id=None):
+    """Crée une arène et branche ses métriques ; renvoie (arena_id, moteur)."""
+    arena_engine = manager.createArena(arena_id)
+    if arena_id is None:
+        arena_id = next(a for a in manager.getArenaIds() if manager.getArena(a) is arena_engine)
+    character_metrics.attach(arena_id, arena_engine)
+    turn_metrics.attach(arena_id, arena_engine)
+    return arena_id, arena_engine
+
+def is_fly_destination(target_id):
+    """Vrai si target_id est une arène de ce serveur ou un serveur pair (cible de FLY)."""
+    if manager is None:
+        return False
+    return manager.getArena(target_id) is not None or target_id in manager.getPeers()
+
+def forget_transfer(cid):
+    """Oublie le dernier départ de cid (nouveau FLY ou retour du personnage) pour que /transfer/<cid> ne renvoie pas un transfert périmé."""
+    if manager is not None:
+        manager.forgetOutgoingTransfer(cid)
+
+def validate_character(data):
+    """Renvoie le message d'erreur si les statistiques du personnage sont invalides, sinon None."""
+    # Vérifier que toutes les statistiques nécessaires sont présentes
+    required_fields = ["cid", "teamid", "life", "strength", "armor", "speed"]
+    if not isinstance(data, dict) or not all(field in data for field in required_fields):
+        return "Les statistiques du personnage sont incomplètes."
 
-    # Parcourir tous les personnages dans l'arène
-    for character in active_characters:
-        cid = character.getId()
-        teamid = character._teamid
+    # Vérifier que la somme des statistiques est inférieure ou égale à 20
+    if data["strength"] + data["speed"] + data["life"] + data["armor"] > 20:
+        return "La somme des statistiques ne peut pas dépasser 20."
+    if data["speed"] > 10:
+        return "La vitesse ne peut pas dépasser 10."
+    return None
+
+def batch_results(items, errors, applied, status):
+    """Un résultat par élément : son erreur, ou le statut de son application (404 si le personnage n'est plus là)."""
+    results = []
+    for i, data in enumerate(items):
+        result = {"cid": data.get("cid") if isinstance(data, dict) else None}
+        if errors[i] is not None:
+            result["status"], result["error"] = errors[i]
+        elif applied is None:
+            # valide, mais non appliqué à cause des autres éléments
+            result["status"] = status
+        elif applied[i]:
+            result["status"] = status
+        else:
+            result["status"] = 404
+            result["error"] = f"Personnage avec l'ID '{result['cid']}' introuvable."
+        results.append(result)
+    return results
 
-        # Mettre à jour les métriques pour les personnages vivants
-        character_life.labels(cid=cid, teamid=teamid).set(character.getLife())
-        character_strength.labels(cid=cid, teamid=teamid).set(character.getStrength())
-        character_armor.labels(cid=cid, teamid=teamid).set(character.getArmor())
-        character_speed.labels(cid=cid, teamid=teamid).set(character.getSpeed())
+def batch_response(results, status):
+    """Réponse commune des routes /batch : un résultat par élément, dans l'ordre de la requête."""
+    return jsonify({"applied": status < 400, "results": results}), status
 
 # ---------------------------------- Routes ----------------------------------
 
+@app.route('/arenas', methods=['GET'])
+def get_arenas():
+    """Liste les arènes hébergées par ce serveur."""
+    arenas = []
+    for arena_id in manager.getArenaIds():
+        arena_engine = manager.getArena(arena_id)
+        if arena_engine is None:
+            continue
+        arenas.append({
+            "arena_id": arena_id,
+            "running": arena_engine.isRunning(),
+            "scheduled": manager.isScheduled(arena_id),
+            "turn": arena_engine.getTurnId(),
+            "active_players": arena_engine.getActiveNbPlayer()
+        })
+    return jsonify({"arenas": arenas}), 200
+
+@app.route('/arenas', methods=['POST'])
+def create_arena():
+    """Crée une nouvelle arène. Corps optionnel : {"arena_id": ...}"""
+    try:
+        data = request.get_json(silent=True) or {}
+        arena_id, _ = new_arena(data.get("arena_id"))
+        log.info("create arena", extra={"fields": {"arena": arena_id}})
+        return jsonify({"arena_id": arena_id}), 201
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 409
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/arenas/<arena_id>', methods=['DELETE'])
+def delete_arena(arena_id):
+    """Arrête et supprime une arène."""
+    if arena_id == "default":
+        return jsonify({"error": "L'arène 'default' ne peut pas être supprimée."}), 400
+    if manager.removeArena(arena_id) is None:
+        return jsonify({"error": f"Arène '{arena_id}' introuvable."}), 404
+    character_metrics.clear(arena_id)
+    turn_metrics.clear(arena_id)
+    log.info("delete arena", extra={"fields": {"arena": arena_id}})
+    return jsonify({"message": f"L'arène '{arena_id}' a été supprimée."}), 200
+
 @app.route('/join', methods=['POST'])
 def join_arena():
     """Crée un personnage et l'ajoute directement à l'arène."""
+    engine = get_engine()
     data = request.json  # Récupérer les données JSON envoyées dans la requête
 
-    # Vérifier que toutes les statistiques nécessaires sont présentes
-    required_fields = ["cid", "teamid", "life", "strength", "armor", "speed"]
-    if not all(field in data for field in required_fields):
-        return jsonify({"error": "Les statistiques du personnage sont incomplètes."}), 400
+    error = validate_character(data)
+    if error is not None:
+        return jsonify({"error": error}), 400
 
     # Extraire les données du personnage
     cid = data["cid"]
@@ -83,35 +194,144 @@ def join_arena():
     armor = data["armor"]
     speed = data["speed"]
 
-    # Vérifier que la somme des statistiques est inférieure ou égale à 20
-    if strength + speed + life + armor > 20:
-        return jsonify({"error": "La somme des statistiques ne peut pas dépasser 20."}), 400
-    if speed > 10:
-        return jsonify({"error": "La vitesse ne peut pas dépasser 10."}), 400
-
     # Créer le personnage
     try:
         # Créer le personnage avec les caractéristiques données
         character = CharacterProxy(cid, teamid, life, strength, armor, speed)
-        print(character)
+        log.info("join", extra={"fields": {"cid": cid, "teamid": teamid, "life": life, "strength": strength, "armor": armor, "speed": speed}})
         # Ajouter le personnage à l'arène via l'Engine
         engine.addPlayer(character, request.remote_addr)
+        forget_transfer(cid)
 
         total_characters.inc()
-        update_character_metrics()
-        
+
         # Retourner une réponse de succès
         return jsonify({"message": f"Le personnage '{cid}' a été créé et ajouté à l'arène avec succès."}), 201
     except Exception as e:
         # Gérer les erreurs
         return jsonify({"error": str(e)}), 500
 
+@app.route('/batch/join', methods=['POST'])
+def join_arena_batch():
+    """Ajoute plusieurs personnages en une requête : tous ou aucun.
+
+    Corps : {"characters": [{"cid": ..., "teamid": ..., "life": ..., ...}, ...]}
+    """
+    engine = get_engine()
+    try:
+        items = (request.json or {}).get("characters")
+        if not isinstance(items, list):
+            return jsonify({"error": "La liste 'characters' est manquante."}), 400
+
+        def prepare():
+            # appelé par le moteur entre deux tours, juste avant l'ajout
+            errors = [validate_character(data) for data in items]
+            if any(error is not None for error in errors):
+                return [None if error is None else (400, error) for error in errors], None
+            for data in items:
+                forget_transfer(data["cid"])
+            return errors, [CharacterProxy(d["cid"], d["teamid"], d["life"], d["strength"], d["armor"], d["speed"]) for d in items]
+
+        errors, applied = engine.addPlayersChecked(prepare, request.remote_addr)
+        results = batch_results(items, errors, applied, 201)
+        if applied is None:
+            return batch_response(results, 400)
+        log.info("join batch", extra={"fields": {"count": len(items)}})
+        total_characters.inc(len(items))
+        return batch_response(results, 201)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/batch/set_action', methods=['POST'])
+def set_action_batch():
+    """Définit l'action (et éventuellement la cible) de plusieurs personnages : tous ou aucun.
+
+    Corps : {"actions": [{"cid": ..., "action": "HIT", "target_id": ...}, ...]}, "target_id" est optionnel.
+    """
+    engine = get_engine()
+    try:
+        items = (request.json or {}).get("actions")
+        if not isinstance(items, list):
+            return jsonify({"error": "La liste 'actions' est manquante."}), 400
+
+        def prepare():
+            # appelé par le moteur entre deux tours : les personnages et les cibles
+            # vérifiés ici sont encore là quand les actions sont appliquées
+            errors = []
+            changes = []
+            for data in items:
+                cid = data.get("cid") if isinstance(data, dict) else None
+                action = data.get("action") if isinstance(data, dict) else None
+                target_id = data.get("target_id") if isinstance(data, dict) else None
+                error = None
+                if cid is None or action is None:
+                    error = (400, "L'ID du personnage et l'action sont manquants.")
+                elif action not in ACTION.__members__:
+                    error = (400, f"L'action '{action}' n'est pas valide.")
+                elif engine.getPlayerByName(cid) is None:
+                    error = (404, f"Personnage avec l'ID '{cid}' introuvable.")
+                elif target_id is not None and engine.getPlayerByName(target_id) is None and not (action == "FLY" and is_fly_destination(target_id)):
+                    error = (404, f"Personnage avec l'ID '{target_id}' introuvable.")
+                else:
+                    changes.append((cid, ACTION[action].value, target_id))
+                errors.append(error)
+            if all(error is None for error in errors):
+                for cid, action, _ in changes:
+                    if action == ACTION.FLY.value:
+                        forget_transfer(cid)
+            return errors, changes
+
+        errors, applied = engine.setActionsChecked(prepare)
+        results = batch_results(items, errors, applied, 200)
+        return batch_response(results, 200 if applied is not None else 400)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/batch/set_target', methods=['POST'])
+def set_target_batch():
+    """Définit la cible de plusieurs personnages : tous ou aucun.
+
+    Corps : {"targets": [{"cid": ..., "target_id": ...}, ...]}
+    """
+    engine = get_engine()
+    try:
+        items = (request.json or {}).get("targets")
+        if not isinstance(items, list):
+            return jsonify({"error": "La liste 'targets' est manquante."}), 400
+
+        def prepare():
+            # appelé par le moteur entre deux tours, comme pour /batch/set_action
+            errors = []
+            changes = []
+            for data in items:
+                cid = data.get("cid") if isinstance(data, dict) else None
+                target_id = data.get("target_id") if isinstance(data, dict) else None
+                error = None
+                if cid is None or target_id is None:
+                    error = (400, "Les IDs du personnage et de la cible sont manquants.")
+                elif engine.getPlayerByName(cid) is None:
+                    error = (404, f"Personnage avec l'ID '{cid}' introuvable.")
+                elif engine.getPlayerByName(target_id) is None and not is_fly_destination(target_id):
+                    # même vérification que /set_target : pour FLY, une arène ou un serveur pair
+                    error = (404, f"Personnage avec l'ID '{target_id}' introuvable.")
+                else:
+                    changes.append((cid, None, target_id))
+                errors.append(error)
+            return errors, changes
+
+        errors, applied = engine.setActionsChecked(prepare)
+        results = batch_results(items, errors, applied, 200)
+        return batch_response(results, 200 if applied is not None else 400)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/characters', methods=['GET'])
 def get_characters():
     """Renvoie tous les IDs des personnages présents dans l'arène."""
+    engine = get_engine()
     try:
         # Extraire les IDs des personnages depuis l'arène via `engine`
-        character_ids = [character.getId() for character in engine._arena._playersList]
+        character_ids = engine.getPlayerIds()
         return jsonify({"characters": character_ids}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -119,9 +339,10 @@ def get_characters():
 @app.route('/character/<cid>', methods=['GET'])
 def get_character(cid):
     """Renvoie les statistiques d'un joueur donné à partir de son ID."""
+    engine = get_engine()
     try:
         # Chercher le personnage dans l'arène via son ID
-        character = next((char for char in engine._arena._playersList if char.isId(cid)), None)
+        character = engine.getPlayerByName(cid)
         
         if character is None:
             return jsonify({"error": f"Personnage avec l'ID '{cid}' introuvable."}), 404
@@ -131,29 +352,127 @@ def get_character(cid):
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/snapshot', methods=['GET'])
+def get_snapshot():
+    """Renvoie tous les personnages (avec leur champ "dead") et le numéro du tour en une requête.
+
+    Paramètres optionnels :
+      - since : numéro de tour ; avec wait=1, la requête attend la fin d'un tour
+        plus récent (long-poll, au plus `timeout` secondes, 30 par défaut)
+    L'état est calculé une fois par tour et renvoyé avec un ETag : un client
+    qui envoie If-None-Match avec l'ETag courant reçoit 304 sans corps.
+    """
+    engine = get_engine()
+    try:
+        since = request.args.get("since", type=int)
+        if since is not None and request.args.get("wait", "0") not in ("0", "false"):
+            timeout = min(request.args.get("timeout", 30, type=float), 60)
+            engine.waitForTurn(since, timeout)
+
+        _, body, etag = engine.getSnapshot()
+        response = app.response_class(body, mimetype="application/json")
+        response.set_etag(etag)
+        # 304 sans corps si If-None-Match correspond à l'ETag courant
+        return response.make_conditional(request)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/states', methods=['GET'])
+def get_states():
+    """Renvoie l'état de l'arène pour les tours conservés entre `from` et `to` (inclus, optionnels)."""
+    engine = get_engine()
+    try:
+        first = request.args.get("from", type=int)
+        last = request.args.get("to", type=int)
+        return engine.getStates(first, last), 200, {"Content-Type": "application/json"}
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/delta', methods=['GET'])
+def get_delta():
+    """Renvoie seulement les personnages modifiés depuis le tour `since`.
+
+    Sans `since`, ou si ce tour est trop ancien, renvoie un état complet
+    ("type": "keyframe") ; sinon "type": "delta" avec "changed" (champs
+    modifiés par personnage) et "removed" (IDs des personnages partis).
+    """
+    engine = get_engine()
+    try:
+        since = request.args.get("since", type=int)
+        return jsonify(engine.getDelta(since)), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/events', methods=['GET'])
+def stream_events():
+    """Flux Server-Sent Events : un message "turn" à la fin de chaque tour.
+
+    Chaque message contient le numéro du tour et ses événements (damage,
+    death, gold, leave_arena). Un client trop lent pour suivre est déconnecté.
+    """
+    engine = get_engine()
+    subscription = engine.subscribe()
+
+    def stream():
+        try:
+            # envoyer les en-têtes tout de suite
+            yield ": connected\n\n"
+            while True:
+                message = subscription.get(timeout=15)
+                if message is not None:
+                    yield f"event: turn\ndata: {message}\n\n"
+                elif subscription.dropped:
+                    break
+                else:
+                    # commentaire pour garder la connexion ouverte
+                    yield ": keep-alive\n\n"
+        finally:
+            engine.unsubscribe(subscription)
+
+    return Response(stream_with_context(stream()), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.route('/status', methods=['GET'])
+def get_status():
+    """Renvoie les résultats d'un tour : dégâts, morts, or et départs."""
+    engine = get_engine()
+    try:
+        turn_number = request.args.get("turn_number", type=int)
+        if turn_number is None:
+            return jsonify({"error": "Le paramètre 'turn_number' est manquant ou invalide."}), 400
+
+        events = engine.getTurnEvents(turn_number)
+        if events is None:
+            return jsonify({"error": f"Aucun résultat pour le tour {turn_number}."}), 404
+        return jsonify({"turn_number": turn_number, "events": events}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/active_players', methods=['GET'])
 def get_active_players():
     """Récupère la liste des joueurs actifs dans l'arène."""
+    engine = get_engine()
     try:
-        active_players = engine._arena.getActiveNbPlayer()
-        return jsonify({"active_players": active_players}), 200
+        active_players = engine.getActiveNbPlayer()
+        return jsonify({"active_players": active_players, "pending": engine.getPendingPlayers()}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500   
 
 @app.route('/is_ready_for_next_turn', methods=['GET'])
 def is_ready_for_next_turn():
     """Vérifie si tous les joueurs sont prêts pour un nouveau tour."""
+    engine = get_engine()
     try:
         if engine.isReady():
             return jsonify({"message": "Tous les joueurs sont prêts pour le prochain tour."}), 200
         else:
-            return jsonify({"error": "Tous les joueurs ne sont pas prêts."}), 400
+            return jsonify({"error": "Tous les joueurs ne sont pas prêts.", "pending": engine.getPendingPlayers()}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/set_target', methods=['POST'])
 def set_target():
     """Permet à un personnage de choisir une cible."""
+    engine = get_engine()
     try:
         # Récupérer les données du joueur et de la cible depuis la requête
         data = request.json
@@ -167,19 +486,16 @@ def set_target():
         target_id = data["target_id"]
 
         # Trouver le personnage avec l'ID donné
-        character = next((char for char in engine._arena._playersList if char.isId(cid)), None)
+        character = engine.getPlayerByName(cid)
         if character is None:
             return jsonify({"error": f"Personnage avec l'ID '{cid}' introuvable."}), 404
 
-        # Trouver la cible avec l'ID donné
-        target = next((char for char in engine._arena._playersList if char.isId(target_id)), None)
-        if target is None:
+        # Trouver la cible avec l'ID donné (pour FLY : une arène de ce serveur ou un serveur pair)
+        target = engine.getPlayerByName(target_id)
+        if target is None and not is_fly_destination(target_id):
             return jsonify({"error": f"Personnage avec l'ID '{target_id}' introuvable."}), 404
 
-        # Définir la cible pour le personnage
-        character.setTarget(target_id)
-
-        # Appliquer la mise à jour dans l'arène
+        # Définir la cible pour le personnage dans l'arène
         engine.setTargetTo(cid, target_id)
 
         # Retourner une réponse de succès
@@ -194,6 +510,7 @@ def set_target():
 @app.route('/set_action', methods=['POST'])
 def set_action():
     """Permet à un personnage de définir une action."""
+    engine = get_engine()
     try:
 
         # Récupérer les données du joueur et de l'action depuis la requête
@@ -213,22 +530,14 @@ def set_action():
             return jsonify({"error": f"L'action '{action}' n'est pas valide."}), 400
 
         # Trouver le personnage avec l'ID donné
-        character = next((char for char in engine._arena._playersList if char.isId(cid)), None)
+        character = engine.getPlayerByName(cid)
         if character is None:
             return jsonify({"error": f"Personnage avec l'ID '{cid}' introuvable."}), 404
 
-        # Définir l'action pour le personnage
-        if action == "HIT":
-            character.setAction(ACTION.HIT)
-        elif action == "BLOCK":
-            character.setAction(ACTION.BLOCK)
-        elif action == "DODGE":
-            character.setAction(ACTION.DODGE)
-        elif action == "FLY":
-            character.setAction(ACTION.FLY)
-
         # Appliquer l'action et mettre à jour l'état du personnage
-        engine.setActionTo(cid, character.getAction())
+        if action == "FLY":
+            forget_transfer(cid)
+        engine.setActionTo(cid, ACTION[action].value)
 
         # Retourner une réponse de succès
         return jsonify({"message": f"Le personnage '{cid}' a choisi l'action '{action}'."}), 200
@@ -242,48 +551,52 @@ def set_action():
 @app.route('/start')
 def start_game():
     """Démarrer le moteur de jeu."""
+    engine = get_engine()
     try:
         # Vérifier si le moteur de jeu est déjà en cours
-        if engine.isRunning():
+        if engine.isRunning() or (manager is not None and manager.isScheduled(get_arena_id())):
             return jsonify({"error": "Le jeu est déjà en cours."}), 400
 
-        # Ajouter un log avant de démarrer le thread
-        print("Démarrage du jeu dans un thread séparé")
-        x = threading.Thread(target=run_game)
-        x.start()
+        if manager is not None:
+            # les tours sont joués par le pool de l'ArenaManager dès que l'arène est prête
+            log.info("Démarrage du jeu", extra={"fields": {"arena": get_arena_id()}})
+            manager.startArena(get_arena_id())
+        else:
+            # Ajouter un log avant de démarrer le thread
+            log.info("Démarrage du jeu dans un thread séparé")
+            x = threading.Thread(target=run_game, args=(engine,))
+            x.start()
 
         return jsonify({"message": "Le jeu a démarré avec succès."}), 200
 
     except Exception as e:
-        print(f"Erreur lors du démarrage du jeu : {str(e)}")
+        log.exception("Erreur lors du démarrage du jeu")
         return jsonify({"error": str(e)}), 500
 
 @app.route('/stop')
 def stop_game():
+    engine = get_engine()
     try:
-        if not engine.isRunning():
+        if manager is not None and manager.isScheduled(get_arena_id()):
+            # Arrêter le jeu (aussi s'il attendait encore les joueurs)
+            manager.stopArena(get_arena_id())
+        elif not engine.isRunning():
             return jsonify({"error": "Le jeu n'est pas en cours."}), 400
-        
-        # Arrêter le jeu
-        engine.stop()
+        else:
+            # Arrêter le jeu
+            engine.stop()
 
-        # Supprimer toutes les métriques des personnages
-        clear_character_metrics()
+        # Supprimer les métriques des personnages de cette arène
+        character_metrics.clear(get_arena_id())
 
         return jsonify({"message": "Le jeu a été stoppé avec succès et toutes les métriques ont été réinitialisées."}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-def clear_character_metrics():
-    """Supprime toutes les métriques des personnages actifs dans Prometheus."""
-    
-    for metric in [character_life, character_strength, character_armor, character_speed]:
-        # Supprimer toutes les valeurs des métriques pour les personnages disparus
-        metric.remove()
-
 @app.route('/add_random_characters')
 def add_random_characters():
     """Ajoute 5 personnages avec des statistiques aléatoires à l'arène."""
+    engine = get_engine()
     try:
         characters_added = []
         for i in range(5):
@@ -325,16 +638,18 @@ def add_random_characters():
                 "speed": stats["speed"]
             }
 
-            # Ajouter le personnage via l'API /join
-            response = requests.post("http://localhost:5000/join", json=character_data)
-
-            if response.status_code == 201:
-                characters_added.append(character_data)
-            else:
+            error = validate_character(character_data)
+            if error is not None:
                 return jsonify({
                     "error": f"Échec lors de l'ajout du personnage '{cid}'.",
-                    "details": response.json()
+                    "details": {"error": error}
                 }), 500
+            characters_added.append(character_data)
+
+        # Ajouter les personnages en une seule fois, sans repasser par l'API /join
+        characters = [CharacterProxy(d["cid"], d["teamid"], d["life"], d["strength"], d["armor"], d["speed"]) for d in characters_added]
+        engine.addPlayers(characters, request.remote_addr)
+        total_characters.inc(len(characters))
 
         return jsonify({
             "message": "5 personnages aléatoires ont été ajoutés avec succès.",
@@ -347,6 +662,7 @@ def add_random_characters():
 @app.route('/leave', methods=['DELETE'])
 def leave_arena():
     """Supprime un personnage de l'arène."""
+    engine = get_engine()
     data = request.json  # Récupérer les données JSON envoyées dans la requête
 
     # Vérifier que le cid est bien présent dans la requête
@@ -359,32 +675,101 @@ def leave_arena():
     
     # Vérifier si le personnage existe (par exemple, via l'Engine ou la base de données)
     character = engine.getPlayerByName(cid)  
-    print(character, "delete")
+    log.info("leave", extra={"fields": {"cid": cid, "found": character is not None}})
     if not character:
         return jsonify({"error": f"Le personnage '{cid}' n'existe pas."}), 404
     
     # Supprimer le personnage de l'arène
-    engine._arena.removePlayer(character)  
+    engine.removePlayer(character)
 
     # Retourner une réponse de succès
     return jsonify({"message": f"Le personnage '{cid}' a été supprimé de l'arène avec succès."}), 200
 
-def run_game():
-    while not engine.isReadyToStart():
-        time.sleep(1)
+# -------------------------------- Transferts (FLY) ---------------------------
+
+@app.route('/transfer/prepare', methods=['POST'])
+def prepare_transfer():
+    """Première étape d'un transfert depuis un autre serveur : réserve le cid.
+
+    Corps : {"transfer_id": ..., "arena_id": ..., "character": {...}, "gold": ..., "ip": ...}
+    Rejouer la requête avec le même transfer_id renvoie le même résultat.
+    """
+    data = request.get_json(silent=True) or {}
+    transfer_id = data.get("transfer_id")
+    character = data.get("character")
+    if transfer_id is None:
+        return jsonify({"error": "Le 'transfer_id' est manquant."}), 400
+    error = validate_character(character)
+    if error is not None:
+        return jsonify({"error": error}), 400
+    arena_id = data.get("arena_id") or "default"
+    if manager.getArena(arena_id) is None:
+        return jsonify({"error": f"Arène '{arena_id}' introuvable."}), 404
+
+    def is_taken(arena_id, cid):
+        arena_engine = manager.getArena(arena_id)
+        return arena_engine is None or arena_engine.getPlayerByName(cid) is not None
+
+    state = transfers.prepare(transfer_id, arena_id, character, data.get("gold", 0), data.get("ip"), is_taken)
+    if state is None:
+        return jsonify({"error": f"Le personnage '{character['cid']}' est déjà dans l'arène."}), 409
+    return jsonify({"transfer_id": transfer_id, "state": state}), 200
+
+@app.route('/transfer/commit', methods=['POST'])
+def commit_transfer():
+    """Seconde étape : ajoute le personnage à l'arène, une seule fois par transfer_id."""
+    transfer_id = (request.get_json(silent=True) or {}).get("transfer_id")
+
+    def apply(transfer):
+        d = transfer["character"]
+        character = CharacterProxy(d["cid"], d["teamid"], d["life"], d["strength"], d["armor"], d["speed"])
+        manager.getArena(transfer["arena_id"]).addPlayer(character, transfer["ip"], transfer["gold"])
+        # le personnage est de retour : son ancien départ d'ici est terminé
+        forget_transfer(d["cid"])
+        log.info("transfer in", extra={"fields": {"transfer": transfer_id, "cid": d["cid"], "arena": transfer["arena_id"]}})
+
+    state = transfers.commit(transfer_id, apply)
+    if state is None:
+        return jsonify({"error": f"Transfert '{transfer_id}' introuvable."}), 404
+    return jsonify({"transfer_id": transfer_id, "state": state}), 200
+
+@app.route('/transfer/abort', methods=['POST'])
+def abort_transfer():
+    """Annule un transfert préparé (sans effet s'il a déjà été validé)."""
+    transfer_id = (request.get_json(silent=True) or {}).get("transfer_id")
+    state = transfers.abort(transfer_id)
+    if state is None:
+        return jsonify({"error": f"Transfert '{transfer_id}' introuvable."}), 404
+    return jsonify({"transfer_id": transfer_id, "state": state}), 200
+
+@app.route('/transfer/<cid>', methods=['GET'])
+def get_outgoing_transfer(cid):
+    """Dernier départ d'un personnage vers un autre serveur, pour que son agent le suive."""
+    transfer = manager.getOutgoingTransfer(cid)
+    if transfer is None:
+        return jsonify({"error": f"Aucun transfert pour le personnage '{cid}'."}), 404
+    return jsonify(dict(transfer, cid=cid)), 200
+
+def run_game(engine):
+    engine.waitUntilReadyToStart()
     try:
         if engine.isReady():
             if not engine.isRunning():
                 engine.run()
 
     except Exception as e:
-        print(f"Erreur dans run_game : {str(e)}")
+        log.exception("Erreur dans run_game")
 
 # ----------------------------------- Démarrage ----------------------------------
 
 if __name__ == '__main__':
-    # Initialise le moteur
-    engine = Engine()
+    # Initialise le gestionnaire d'arènes et l'arène par défaut
+    # URLs des serveurs pairs vers lesquels FLY peut envoyer les personnages
+    peers = [url.strip().rstrip("/") for url in os.environ.get("ARENA_PEERS", "").split(",") if url.strip()]
+    # Profilage des tours plus longs que ARENA_PROFILE_SLOW_TURNS secondes (désactivé par défaut)
+    profile_slow_turns = os.environ.get("ARENA_PROFILE_SLOW_TURNS")
+    manager = ArenaManager(peers=peers, profileSlowTurns=float(profile_slow_turns) if profile_slow_turns else None)
+    _, engine = new_arena("default")
 
     # Lancer le serveur Flask dans un thread pour permettre les requêtes HTTP
     app.run(host="0.0.0.0",debug=True)
\ No newline at end of file
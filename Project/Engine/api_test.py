@@ -1,63 +1,342 @@
-from random import randint
-from action import *
-import requests
+"""Benchmark of the arena API and of the engine.
+
+Load test: N simulated agents join, then send /set_target and /set_action
+every turn and wait for the next one with /snapshot (long-poll). Reports
+the latency percentiles of each route, the turns per second and the
+memory of the server. Without --url, ApiArena is started in this process
+on localhost.
+
+Micro-benchmarks (--micro): Engine.single_run, Arena.toDict and Data
+(addData + save + flush of one turn of events) at 10, 1k and 100k
+characters.
+
+Throughput (--throughput): turns per second of several arenas played
+together by an ArenaManager, without a process pool then with pools of
+--processes sizes (the attacks are then resolved by ProcessResolver).
+
+Resolver check (--check): the same random games (life 0 characters, late
+joins, FLY and unknown targets included) are played with every resolver, which must
+log the same events and end with the same lives, gold and RNG state.
+
+    python api_test.py --agents 200 --turns 20
+    python api_test.py --micro --json bench.json
+    python api_test.py --micro --compare bench.json   # exit code 1 on regression
+    python api_test.py --throughput --arenas 4 --characters 20000 --processes 0,2,4
+    python api_test.py --check --seeds 20             # exit code 1 on a difference
+"""
+from concurrent.futures import ThreadPoolExecutor
+from engine import *
+from manager import *
+from requests.adapters import HTTPAdapter
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
 import time
+import requests
+
+ACTIONS = ["HIT", "BLOCK", "DODGE"]
+
+
+def percentiles(values):
+    values = sorted(values)
+    if not values:
+        return {}
+    pick = lambda p: values[min(len(values) - 1, int(p * len(values)))]
+    return {"count": len(values), "p50": pick(0.50), "p90": pick(0.90), "p99": pick(0.99), "max": values[-1]}
+
+
+#### load test ####
+
+class LoadClient:
+    """Pooled HTTP client recording the latency of each route."""
+
+    def __init__(self, url, concurrency):
+        self.url = url.rstrip("/")
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount("http://", adapter)
+        self.latencies = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def call(self, method, route, **kwargs):
+        start = time.perf_counter()
+        response = self.session.request(method, self.url + route, timeout=70, **kwargs)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.latencies.setdefault(route, []).append(elapsed)
+            if response.status_code >= 400:
+                self.errors[route] = self.errors.get(route, 0) + 1
+        return response
+
+    def serverMemory(self):
+        """Resident memory of the server in bytes, read from /metrics (None if unknown)."""
+        response = self.session.get(self.url + "/metrics", timeout=10)
+        for line in response.text.splitlines():
+            if line.startswith("process_resident_memory_bytes"):
+                return float(line.split()[1])
+        return None
+
+
+def startLocalServer(port, characterTimeout):
+    """Start ApiArena in this process, in a temporary directory; return its URL."""
+    from werkzeug.serving import make_server
+    import logging
+    import ApiArena
+    os.chdir(tempfile.mkdtemp(prefix="arena-bench-"))
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    ApiArena.manager = ArenaManager(characterTimeout=characterTimeout)
+    _, ApiArena.engine = ApiArena.new_arena("default")
+    server = make_server("127.0.0.1", port, ApiArena.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return "http://127.0.0.1:%d" % port
+
+
+def loadTest(url, nbAgents, nbTurns, concurrency, seed):
+    rng = random.Random(seed)
+    client = LoadClient(url, concurrency)
+    pool = ThreadPoolExecutor(concurrency)
+    cids = ["bench-%d" % i for i in range(nbAgents)]
+
+    # strength 1: the game lasts long enough to measure steady turns
+    join = lambda i: client.call("POST", "/join", json={"cid": cids[i], "teamid": "T%d" % (i % 4), "life": 16, "strength": 1, "armor": 1, "speed": 2})
+    list(pool.map(join, range(nbAgents)))
+    memoryBefore = client.serverMemory()
+    client.call("GET", "/start")
+
+    def play(cid, target, action):
+        client.call("POST", "/set_target", json={"cid": cid, "target_id": target})
+        client.call("POST", "/set_action", json={"cid": cid, "action": action})
+
+    turns = 0
+    turn = client.call("GET", "/snapshot").json()["round"]
+    start = time.perf_counter()
+    while turns < nbTurns:
+        alive = [c["cid"] for c in client.call("GET", "/snapshot").json()["arena"] if not c["dead"]]
+        if len(alive) < 2:
+            break
+        moves = [(cid, rng.choice([c for c in alive if c != cid]), rng.choice(ACTIONS)) for cid in alive]
+        list(pool.map(lambda move: play(*move), moves))
+        turn = client.call("GET", "/snapshot", params={"since": turn, "wait": 1}).json()["round"]
+        turns += 1
+    elapsed = time.perf_counter() - start
+
+    pool.shutdown()
+    return {
+        "agents": nbAgents,
+        "turns": turns,
+        "turns_per_second": turns / elapsed if elapsed else None,
+        "server_memory_bytes": {"after_join": memoryBefore, "end": client.serverMemory()},
+        "routes": {route: percentiles(values) for route, values in sorted(client.latencies.items())},
+        "errors": client.errors,
+    }
+
+
+#### micro-benchmarks ####
+
+def timeit(fn, repeat):
+    """Best of `repeat` calls of fn, which returns the time it measured."""
+    best = None
+    for _ in range(repeat):
+        elapsed = fn()
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def microBenchmarks(sizes, seed):
+    directory = tempfile.mkdtemp(prefix="arena-bench-")
+    results = {}
+    for n in sizes:
+        rng = random.Random(seed)
+        repeat = max(3, min(200, 100000 // n))
+        engine = Engine(dataName=os.path.join(directory, "data-%d" % n), seed=seed)
+        # life high enough for nobody to die during the benchmark
+        engine.addPlayers([CharacterProxy(str(i), "T", 10**9, rng.randint(1, 5), rng.randint(0, 5), rng.randint(0, 10)) for i in range(n)], "bench")
+        cids = engine.getPlayerIds()
+
+        def singleRun():
+            engine.setActionsTo([(cid, rng.randint(0, 2), rng.choice(cids)) for cid in cids])
+            start = time.perf_counter()
+            engine.single_run()
+            return time.perf_counter() - start
+
+        def arenaToDict():
+            # after a turn, as the API sees it
+            engine.setActionsTo([(cid, rng.randint(0, 2), rng.choice(cids)) for cid in cids])
+            engine.single_run()
+            start = time.perf_counter()
+            engine._arena.toDict()
+            return time.perf_counter() - start
+
+        data = engine._data
+        event = {"character": "0", "target": "1", "damage": 3, "reduced": 0, "dodged": 0}
+
+        def dataSave():
+            # one turn of damage events, persisted
+            data.flush()
+            start = time.perf_counter()
+            for _ in range(n):
+                data.addData("damage", event)
+            data.save()
+            data.flush()
+            return time.perf_counter() - start
+
+        results[str(n)] = {
+            "Engine.single_run": timeit(singleRun, repeat),
+            "Arena.toDict": timeit(arenaToDict, repeat),
+            "Data.save": timeit(dataSave, repeat),
+        }
+        data.close()
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Names of the micro-benchmarks more than `tolerance` slower than the baseline."""
+    regressions = []
+    for n, timings in results.items():
+        for name, elapsed in timings.items():
+            reference = baseline.get(n, {}).get(name)
+            if reference and elapsed > reference * (1 + tolerance):
+                regressions.append("%s@%s: %.6fs vs %.6fs" % (name, n, elapsed, reference))
+    return regressions
+
+
+#### throughput ####
+
+def throughputBenchmark(processesList, nbArenas, nbCharacters, duration, seed):
+    """Turns per second of nbArenas arenas, for each process pool size (0: no pool)."""
+    results = {}
+    for processes in processesList:
+        manager = ArenaManager(maxWorkers=nbArenas, processes=processes or None, seed=seed, characterTimeout=30, persist=False)
+        engines = []
+        for k in range(nbArenas):
+            engine = manager.createArena("bench-%d" % k)
+            rng = random.Random(seed + k)
+            # life high enough for nobody to die, half of the characters hit, the others dodge
+            engine.addPlayers([CharacterProxy(str(i), "T", 10**9, rng.randint(1, 5), rng.randint(0, 5), rng.randint(0, 10)) for i in range(nbCharacters)], "bench")
+            changes = [(str(i), 0 if i % 2 else 2, str(rng.randrange(nbCharacters))) for i in range(nbCharacters)]
+            # every character plays again right after each turn: the arenas never wait for actions
+            engine.addTurnListener(lambda stats, engine=engine, changes=changes: engine.setActionsTo(changes))
+            engine.setActionsTo(changes)
+            engines.append(engine)
+        start = time.perf_counter()
+        for k in range(nbArenas):
+            manager.startArena("bench-%d" % k)
+        time.sleep(duration)
+        turns = sum(engine.getTurnId() for engine in engines)
+        elapsed = time.perf_counter() - start
+        manager.close()
+        results["processes=%d" % processes] = turns / elapsed
+    return results
+
+
+#### resolver check ####
+
+def playCheckGame(resolver, seed, nbCharacters, maxTurns):
+    """Events, gold, lives and final RNG state of one random game."""
+    rng = random.Random(seed)
+    engine = Engine(resolver=resolver, seed=seed, persist=False, recordTurns=False)
+    events = []
+    engine.addEventListener(lambda key, value: events.append((key, json.dumps(value))))
+    # some characters join with life 0: they are alive until something damages them
+    engine.addPlayers([CharacterProxy(str(i), "T%d" % (i % 3), rng.choice([0, rng.randint(1, 12)]), rng.randint(0, 5), rng.randint(0, 5), rng.randint(0, 10)) for i in range(nbCharacters)], "check")
+    for turn in range(maxTurns):
+        alive = [character.getId() for character in engine._arena.getPlayers() if not character.isDead()]
+        if len(alive) < 2:
+            break
+        if turn % 10 == 9:
+            # a late join changes the roster between two turns
+            engine.addPlayer(CharacterProxy("late-%d" % turn, "T0", rng.randint(1, 12), rng.randint(0, 5), rng.randint(0, 5), rng.randint(0, 10)), "check")
+        engine.setActionsTo([(cid, rng.choice([0, 1, 2, 2, 3] if rng.random() < 0.05 else [0, 1, 2, 2]), rng.choice(alive + ["ghost"])) for cid in alive])
+        engine.single_run()
+    players = [(character.getId(), character.getLife(), character.isDead()) for character in engine._arena.getPlayers()]
+    return events, engine._goldBook, players, engine._rng.getstate()
+
+
+def checkResolvers(seeds, nbCharacters, maxTurns, processes=2):
+    """Seeds for which a resolver does not play exactly like the python one."""
+    from concurrent.futures import ProcessPoolExecutor
+    resolvers = {"numpy": lambda: "numpy"}
+    pool = ProcessPoolExecutor(processes) if processes else None
+    if pool is not None:
+        resolvers["process"] = lambda: ProcessResolver(pool)
+    differences = []
+    try:
+        for seed in seeds:
+            expected = playCheckGame("python", seed, nbCharacters, maxTurns)
+            for name, resolver in resolvers.items():
+                if playCheckGame(resolver(), seed, nbCharacters, maxTurns) != expected:
+                    differences.append("%s differs from python with seed %d" % (name, seed))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return differences
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Arena benchmarks")
+    parser.add_argument("--url", help="server to load (default: start ApiArena in this process)")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--agents", type=int, default=100)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--micro", action="store_true", help="run the micro-benchmarks instead of the load test")
+    parser.add_argument("--throughput", action="store_true", help="measure the turns per second of several arenas")
+    parser.add_argument("--arenas", type=int, default=4)
+    parser.add_argument("--characters", type=int, default=20000, help="characters per arena for --throughput")
+    parser.add_argument("--processes", default="0,2,4", help="process pool sizes for --throughput (0: no pool)")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds measured for each pool size")
+    parser.add_argument("--check", action="store_true", help="check that the resolvers play the same games")
+    parser.add_argument("--seeds", type=int, default=20, help="number of games played by --check")
+    parser.add_argument("--sizes", default="10,1000,100000")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="micro-benchmark results to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+    if args.compare and not args.micro:
+        parser.error("--compare only applies to the micro-benchmarks")
+
+    if args.check:
+        differences = checkResolvers(range(args.seeds), 60, 200)
+        for difference in differences:
+            print("DIFFERENCE " + difference)
+        print("%d games checked, %d differences" % (args.seeds, len(differences)))
+        sys.exit(1 if differences else 0)
+    if args.throughput:
+        results = throughputBenchmark([int(p) for p in args.processes.split(",")], args.arenas, args.characters, args.duration, args.seed)
+        for name, rate in results.items():
+            print("%-12s %d arenas x %d characters: %8.2f turns/s" % (name, args.arenas, args.characters, rate))
+    elif args.micro:
+        results = microBenchmarks([int(n) for n in args.sizes.split(",")], args.seed)
+        for n, timings in results.items():
+            for name, elapsed in timings.items():
+                print("%-18s n=%-7s %10.3f ms" % (name, n, elapsed * 1000))
+    else:
+        url = args.url or startLocalServer(args.port, characterTimeout=30)
+        results = loadTest(url, args.agents, args.turns, args.concurrency, args.seed)
+        print("%d agents, %d turns, %.2f turns/s" % (results["agents"], results["turns"], results["turns_per_second"] or 0))
+        print("server memory: %s" % results["server_memory_bytes"])
+        for route, stats in results["routes"].items():
+            print("%-16s n=%-6d p50=%7.2fms p90=%7.2fms p99=%7.2fms max=%7.2fms" % (route, stats["count"], stats["p50"] * 1000, stats["p90"] * 1000, stats["p99"] * 1000, stats["max"] * 1000))
+        if results["errors"]:
+            print("errors: %s" % results["errors"])
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION " + regression)
+        if regressions:
+            sys.exit(1)
 
-url = "http://127.0.0.1:5000/"
-
-def action_selection():
-    r = randint(0, 2)
-    action = None
-    if r == 0:
-        action = ACTION.HIT
-    elif r == 1:
-        action = ACTION.BLOCK
-    elif r == 2:
-        action = ACTION.DODGE
-    elif r == 3:
-        action = ACTION.FLY
-    return r
-
-def cid_selection():
-    return str(randint(10, 1000))
-
-def target_selection(cids):
-    r = randint(0, len(cids) - 1)
-    return cids[r]
-
-teamA = "A"
-teamB = "B"
-
-# add new characters
-a = cid_selection()
-b = cid_selection()
-c = cid_selection()
-d = cid_selection()
-print("Création des cid " + str(a) + " et " + str(b))
-x = requests.get(url + "enterArena/" + str(b) + "/" + teamB + "/14/1/5/0")
-x = requests.get(url + "enterArena/" + str(d) + "/" + teamB + "/3/15/5/2")
-x = requests.get(url + "enterArena/" + str(a) + "/" + teamA + "/10/4/4/2")
-x = requests.get(url + "enterArena/" + str(c) + "/" + teamA + "/8/4/4/4")
-print(x.text)
-
-print(x.text)
-# process a single run
-x = requests.get(url + "run")
-print(x.text)
-
-for j in range(5):
-    # add actions
-    for i in range(5):
-        x = requests.get(url + "setAction/" + str(a) + "/" + str(action_selection()))
-        x = requests.get(url + "setAction/" + str(b) + "/" + str(action_selection()))
-        x = requests.get(url + "setAction/" + str(c) + "/" + str(action_selection()))
-        x = requests.get(url + "setAction/" + str(d) + "/" + str(action_selection()))
-        print(x.text)
-        # add targets
-        x = requests.get(url + "setTarget/" + str(a) + "/" + str(target_selection([b, d])))
-        x = requests.get(url + "setTarget/" + str(c) + "/" + str(target_selection([b, d])))
-        x = requests.get(url + "setTarget/" + str(b) + "/" + str(target_selection([a, c])))
-        x = requests.get(url + "setTarget/" + str(d) + "/" + str(target_selection([a, c])))
-        print(x.text)
-        time.sleep(5)
 
+if __name__ == "__main__":
+    main()
@@ -1,90 +1,254 @@
 from action import *
+import threading
 
 class Arena:
     def __init__(self, data):
+        # ordered view of the characters (turn order once sorted by speed)
         self._playersList = []
+        # cid -> character index, kept consistent with _playersList
+        self._playersIndex = {}
+        # kept up to date by _onCharacterChanged so that the readiness checks are O(1)
+        self._alive = set()
+        # living characters without a complete action
+        self._pending = set()
         self._data = data
+        # incremented on every add/update/remove
+        self._rosterVersion = 0
+        # notified whenever an action, a target or the roster changes
+        self._changed = threading.Condition(threading.RLock())
+        # called (under the arena lock) with no argument on each notification
+        self._changeListeners = []
+        # set between beginTurn() and endTurn(): the character changes are not tracked
+        self._resolving = False
+        # cids of the characters that changed, joined or left since takeChanges()
+        self._dirty = set()
 
     def setActionTo(self, cid, action):
         flag = False
-        for character in self._playersList:
-            if character.isId(cid):
-                if action == 0:
-                    character.setAction(ACTION.HIT)
-                    flag = True
-                elif action == 1:
-                    character.setAction(ACTION.BLOCK)
-                    flag = True
-                elif action == 2:
-                    character.setAction(ACTION.DODGE)
-                    flag = True
-                elif action == 3:
-                    character.setAction(ACTION.FLY)
-                    flag = True
-                self._data.addData("set_action", character.toDict())
+        character = self._playersIndex.get(cid)
+        if character is not None:
+            if action == 0:
+                character.setAction(ACTION.HIT)
+                flag = True
+            elif action == 1:
+                character.setAction(ACTION.BLOCK)
+                flag = True
+            elif action == 2:
+                character.setAction(ACTION.DODGE)
+                flag = True
+            elif action == 3:
+                character.setAction(ACTION.FLY)
+                flag = True
+            self._data.addData("set_action", character.toDict())
         return flag
 
     def setTargetTo(self, cid, target):
         flag = False
-        for character in self._playersList:
-            if character.isId(cid):
-                character.setTarget(target)
-                self._data.addData("set_target", character.toDict())
-                flag = True
+        character = self._playersIndex.get(cid)
+        if character is not None:
+            character.setTarget(target)
+            self._data.addData("set_target", character.toDict())
+            flag = True
         return flag
 
     def getTotalNbPlayer(self):
         return len(self._playersList)
 
     def getActiveNbPlayer(self):
-        deadChars = 0
-        for character in self._playersList:
-            if character.isDead():
-                deadChars += 1
-        return len(self._playersList) - deadChars
+        return len(self._alive)
+
+    def getReadyNbPlayer(self):
+        # living characters with a complete action
+        return len(self._alive) - len(self._pending)
+
+    def getPendingPlayers(self):
+        # cids of the living characters the turn is waiting for
+        return sorted(self._pending, key=str)
 
     def getPlayerByIndex(self, index):
         return self._playersList[index]
 
     def getPlayerByName(self, id):
-        for character in self._playersList:
-            if character.isId(id):
-                return character
-        return None
+        return self._playersIndex.get(id)
+
+    def getPlayers(self):
+        # live roster, for the engine thread; other threads use snapshotPlayers()
+        return self._playersList
+
+    def snapshotPlayers(self):
+        # copy of the roster, taken under the lock so it is never seen mid-update
+        with self._changed:
+            return list(self._playersList)
+
+    def getRosterVersion(self):
+        return self._rosterVersion
+
+    def getPlayerIds(self):
+        return [character.getId() for character in self.snapshotPlayers()]
+
+    def hasPlayer(self, cid):
+        return cid in self._playersIndex
+
+    def sortPlayersBySpeed(self):
+        # the index is keyed by cid, so reordering the list keeps it valid
+        with self._changed:
+            self._playersList.sort(key=lambda x: x.getSpeed(), reverse=True)
+
+    def setPlayersOrder(self, players):
+        # players must be a permutation of the current characters
+        with self._changed:
+            self._playersList[:] = players
 
     def updatePlayer(self, character):
-        for i in range(len(self._playersList)):
-            if self._playersList[i].isId(character.getId()):
-                self._playersList[i] = character
+        cid = character.getId()
+        current = self._playersIndex.get(cid)
+        if current is None or current is character:
+            return
+        with self._changed:
+            self._playersList[self._playersList.index(current)] = character
+            self._playersIndex[cid] = character
+            self._rosterVersion += 1
+            current.setObserver(None)
+            self._track(character)
 
     def addPlayer(self, character):
-        self._playersList.append(character)
+        cid = character.getId()
+        if cid in self._playersIndex:
+            # a character coming back with the same cid replaces its old entry
+            self.updatePlayer(character)
+        else:
+            with self._changed:
+                self._playersList.append(character)
+                self._playersIndex[cid] = character
+                self._rosterVersion += 1
+                self._track(character)
 
     def removePlayer(self, character):
-        for i in range(len(self._playersList)):
-            if character.isId(self._playersList[i].getId()):
-                del self._playersList[i]
-                self._data.addData("leave_arena", character.toDict())
-                break
-
-    # def removeAfkPlayers(self):
-    #     for i in reversed(range(len(self._playersList))):
-    #         cAction, cTarget = self._playersList[i].getAction()
-    #         if cAction is None:
-    #             self._data.addData("leave_arena", self._playersList[i].toDict())
-    #             del self._playersList[i]
+        with self._changed:
+            current = self._playersIndex.pop(character.getId(), None)
+            if current is None:
+                return
+            self._playersList.remove(current)
+            self._rosterVersion += 1
+            self._dirty.add(current.getId())
+            current.setObserver(None)
+            self._alive.discard(current.getId())
+            self._pending.discard(current.getId())
+            self._notifyLocked()
+        self._data.addData("leave_arena", character.toDict())
+
+    def _track(self, character):
+        character.setObserver(self._onCharacterChanged)
+        with self._changed:
+            self._dirty.add(character.getId())
+            self._refresh(character)
+            self._notifyLocked()
+
+    def _onCharacterChanged(self, character):
+        if self._resolving:
+            # only the turn changes the characters, endTurn() catches up
+            self._dirty.add(character.getId())
+            return
+        with self._changed:
+            self._dirty.add(character.getId())
+            if self._refresh(character):
+                self._notifyLocked()
+
+    def _refresh(self, character):
+        # update the counters for one character, return True if they changed
+        cid = character.getId()
+        wasAlive = cid in self._alive
+        wasPending = cid in self._pending
+        if character.isDead():
+            self._alive.discard(cid)
+            self._pending.discard(cid)
+        else:
+            self._alive.add(cid)
+            if self.hasCompleteAction(character):
+                self._pending.discard(cid)
+            else:
+                self._pending.add(cid)
+        return wasAlive != (cid in self._alive) or wasPending != (cid in self._pending)
+
+    def beginTurn(self):
+        """Stop tracking the character changes until endTurn()."""
+        with self._changed:
+            self._resolving = True
+
+    def endTurn(self):
+        """Reset every action and target, rebuild the counters and notify once."""
+        with self._changed:
+            if not self._resolving:
+                return
+            self._resolving = False
+            for character in self._playersList:
+                self.clearAction(character)
+            # nobody has an action anymore: every living character is pending
+            self._alive = {character.getId() for character in self._playersList if not character.isDead()}
+            self._pending = set(self._alive)
+            self._notifyLocked()
+
+    def clearAction(self, character):
+        # during a turn: reset the action and target without any notification
+        if character.clearAction():
+            self._dirty.add(character.getId())
+
+    def setLives(self, lives):
+        # during a turn: set the life of several (character, life) without any notification
+        for character, life in lives:
+            if character.updateLife(life):
+                self._dirty.add(character.getId())
+
+    def takeChanges(self):
+        """(characters, cids) that changed or joined, and that left, since the last call."""
+        with self._changed:
+            dirty = self._dirty
+            self._dirty = set()
+            changed = []
+            removed = []
+            for cid in dirty:
+                character = self._playersIndex.get(cid)
+                if character is None:
+                    removed.append(cid)
+                else:
+                    changed.append(character)
+        return changed, removed
+
+    def removeAfkPlayers(self):
+        # living characters that did not send a complete action before the deadline
+        afk = [self._playersIndex[cid] for cid in self.getPendingPlayers()]
+        for character in afk:
+            self.removePlayer(character)
+        return afk
+
+    def notifyChanged(self):
+        with self._changed:
+            self._notifyLocked()
+
+    def _notifyLocked(self):
+        self._changed.notify_all()
+        for listener in self._changeListeners:
+            listener()
+
+    def addChangeListener(self, listener):
+        """Register listener(), called when an action, a target or the roster changes."""
+        self._changeListeners = self._changeListeners + [listener]
+
+    def waitFor(self, predicate, timeout=None):
+        """Block until predicate() is true or timeout seconds elapsed; return its last value."""
+        with self._changed:
+            return self._changed.wait_for(predicate, timeout)
+
+    def hasCompleteAction(self, character):
+        cAction, cTarget = character.getAction()
+        return not (cAction == None or ((cAction == ACTION.HIT or cAction == ACTION.FLY)  and cTarget == None))
 
     def everyoneHasAnAction(self):
-        for character in self._playersList:
-            if not character.isDead():
-                cAction, cTarget = character.getAction()
-                if cAction == None or ((cAction == ACTION.HIT or cAction == ACTION.FLY)  and cTarget == None):
-                    return False
-        return True
+        return not self._pending
 
     def toDict(self):
         d = {}
         d["arena"] = []
-        for character in self._playersList:
+        for character in self.snapshotPlayers():
             d["arena"].append(character.toDict())
         return d
\ No newline at end of file
@@ -0,0 +1,58 @@
+import queue
+import threading
+
+
+class Subscription:
+    """Bounded queue of messages for one subscriber."""
+
+    def __init__(self, maxSize):
+        self._queue = queue.Queue(maxSize)
+        self.dropped = False
+
+    def get(self, timeout=None):
+        """Next message, or None on timeout or once the subscriber was dropped."""
+        if self.dropped:
+            return None
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class TurnBroadcaster:
+    """Fan-out of turn results to the subscribers.
+
+    A message is published once (already serialized) and the same object is
+    put in every subscriber queue. A subscriber whose queue is full is too
+    slow: it is dropped instead of slowing down the game thread.
+    """
+
+    def __init__(self, maxQueueSize=64):
+        self._maxQueueSize = maxQueueSize
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        subscription = Subscription(self._maxQueueSize)
+        with self._lock:
+            self._subscribers = self._subscribers + [subscription]
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers = [s for s in self._subscribers if s is not subscription]
+
+    def getNbSubscribers(self):
+        return len(self._subscribers)
+
+    def publish(self, message):
+        slow = []
+        # copy-on-write list: no lock needed to iterate it
+        for subscription in self._subscribers:
+            try:
+                subscription._queue.put_nowait(message)
+            except queue.Full:
+                subscription.dropped = True
+                slow.append(subscription)
+        for subscription in slow:
+            self.unsubscribe(subscription)
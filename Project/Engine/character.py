@@ -1,7 +1,14 @@
 from random import randint
 from action import *
+from logger import getLogger
+import logging
+
+log = getLogger("character")
 
 class CharacterProxy:
+    # no per-instance __dict__: arenas can hold a lot of characters
+    __slots__ = ("_id", "_teamid", "_life", "_strength", "_armor", "_speed", "_action", "_target", "_dead", "_dict", "_observer")
+
     def __init__(self, cid :str, teamid :str, life :int, strength :int, armor :int, speed :int):
         self._id = cid
         self._teamid = teamid
@@ -14,6 +21,18 @@ class CharacterProxy:
         self._target = None
         #self._id = self._name + str(randint(0, 1000))
         self._dead = False
+        # cached result of toDict(), reset by the setters when a field changes
+        self._dict = None
+        # called with the character each time a field changes (see Arena)
+        self._observer = None
+
+    def setObserver(self, observer):
+        self._observer = observer
+
+    def _touch(self):
+        self._dict = None
+        if self._observer is not None:
+            self._observer(self)
 
     def isDead(self):
         return self._dead
@@ -24,6 +43,9 @@ class CharacterProxy:
     def getId(self):
         return self._id
 
+    def getTeamId(self):
+        return self._teamid
+
     def getLife(self):
         return self._life
 
@@ -42,25 +64,71 @@ class CharacterProxy:
         return self._action, None
 
     def setLife(self, value):
-        print(f"Setting life for {self._id} from {self._life} to {value}")
+        if self.updateLife(value) and self._observer is not None:
+            self._observer(self)
+
+    def updateLife(self, value):
+        # setLife without notifying the observer (see Arena.setLives); True if a field changed
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("set life", extra={"fields": {"cid": self._id, "old": self._life, "new": value}})
+        # 10 and 10.0 are serialized differently, so the type matters too
+        changed = type(value) is not type(self._life) or value != self._life
         self._life = value
-        if self._life <= 0:
+        if self._life <= 0 and not self._dead:
             self._dead = True
+            changed = True
+        if changed:
+            self._dict = None
+        return changed
 
     def setStrength(self, value):
-        self._strength = value
+        if value != self._strength:
+            self._strength = value
+            self._touch()
 
     def setArmor(self, value):
-        self._armor = value
+        if value != self._armor:
+            self._armor = value
+            self._touch()
 
     def setSpeed(self, value):
-        self._speed = value
+        if value != self._speed:
+            self._speed = value
+            self._touch()
 
     def setAction(self, value):
-        self._action = value
+        if value != self._action:
+            self._action = value
+            self._touch()
     
     def setTarget(self, value):
-        self._target = value
+        if value != self._target:
+            self._target = value
+            self._touch()
+
+    def clearAction(self):
+        # end of turn: the observer is not called, the arena rebuilds its
+        # counters once for every character (see Arena.endTurn); True if something was reset
+        if self._action is not None or self._target is not None:
+            self._action = None
+            self._target = None
+            self._dict = None
+            return True
+        return False
+
+    def reuseDict(self, cDict):
+        # cDict is a dict returned earlier by toDict(): if the character has the
+        # same fields again (e.g. its action was set then reset), toDict() returns
+        # it instead of a new dict; True if it does
+        if cDict is self._dict:
+            return True
+        if (type(cDict["life"]) is not type(self._life) or cDict["life"] != self._life or cDict["dead"] != self._dead
+                or cDict["action"] != ("None" if self._action is None else actionToStr(self._action)) or cDict["target"] != str(self._target)
+                or cDict["strength"] != self._strength or cDict["armor"] != self._armor or cDict["speed"] != self._speed
+                or cDict["teamid"] != self._teamid):
+            return False
+        self._dict = cDict
+        return True
 
     def __str__(self):
         s = "------------\n"
@@ -73,6 +141,9 @@ class CharacterProxy:
         return s
 
     def toDict(self):
+        # the same dict is returned until a field changes: callers must not modify it
+        if self._dict is not None:
+            return self._dict
         cDict = {}
         cDict["cid"] = self._id
         cDict["teamid"] = self._teamid
@@ -83,4 +154,5 @@ class CharacterProxy:
         cDict["action"] = actionToStr(self._action)
         cDict["target"] = str(self._target)
         cDict["dead"] = self._dead
+        self._dict = cDict
         return cDict
@@ -0,0 +1,231 @@
+"""Columnar copy of the game events, for offline analysis.
+
+One table per event type, stored as NumPy .npz parts in a directory
+(<directory>/damage.00000.npz, ...), one typed array per column:
+
+    damage          t, turn, character, target, damage, reduced, dodged
+    death           t, turn, character, killer
+    gold            t, turn, cid, gold
+    enter_arena     t, turn, cid, teamid, life, strength, armor, speed, dead
+    leave_arena     (same columns as enter_arena)
+    set_action      t, turn, cid, action, target
+    set_target      t, turn, cid, target
+    turn_id         t, turn
+
+t is the timestamp of the event and turn the turn it belongs to (the
+events logged before turn_id N belong to turn N). cids and teamids are
+int32 codes into names.npy (-1 for None), and action is the actionToStr
+digit (-1 for None). The other events (start_game, state_*...) are not
+exported.
+
+The parts are written uncompressed: np.load() of a part only reads the
+columns that are accessed, so a query on two columns does not parse the
+others (readColumns(directory, "damage", ["turn", "damage"])).
+
+ColumnarWriter has the append(events) interface of EventLogWriter; Data
+feeds it from its writer thread when given a columnarDir, and writes the
+buffered rows as new parts every flushInterval seconds, so a crash loses
+at most that much. A recorded log is converted with:
+
+    python columnar.py data columns/        # or data.json
+"""
+from eventlog import *
+import argparse
+import glob
+import os
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+PART_PATTERN = "%s.%05d.npz"
+NAMES = "names.npy"
+
+_CHARACTER_COLUMNS = [("cid", "name"), ("teamid", "name"), ("life", "f8"), ("strength", "f8"), ("armor", "f8"), ("speed", "f8"), ("dead", "?")]
+
+# event -> [(column, type)]; "name" columns are coded into names.npy
+SCHEMAS = {
+    "damage": [("character", "name"), ("target", "name"), ("damage", "f8"), ("reduced", "f8"), ("dodged", "f8")],
+    "death": [("character", "name"), ("killer", "name")],
+    "gold": [("cid", "name"), ("gold", "f8")],
+    "enter_arena": _CHARACTER_COLUMNS,
+    "leave_arena": _CHARACTER_COLUMNS,
+    "set_action": [("cid", "name"), ("action", "i1"), ("target", "name")],
+    "set_target": [("cid", "name"), ("target", "name")],
+    "turn_id": [],
+}
+
+
+def columnType(event, column):
+    """NumPy dtype of a column of an event table."""
+    kind = dict(SCHEMAS[event], t="f8", turn="i4")[column]
+    return "i4" if kind == "name" else kind
+
+
+class ColumnarWriter:
+    """Writes the events into columnar parts of `partSize` rows per table.
+
+    The rows are buffered in lists and written when a table reaches
+    partSize rows, at close(), and by flushIfDue() once flushInterval
+    seconds have passed since the last write (None: never). Like
+    EventLogWriter, a new writer starts a new game: the parts already in
+    the directory are removed.
+    """
+
+    def __init__(self, directory, partSize=1000000, flushInterval=None):
+        if np is None:
+            raise ImportError("numpy is required by the columnar export")
+        self._directory = directory
+        self._partSize = partSize
+        self._flushInterval = flushInterval
+        self._lastFlush = time.time()
+        os.makedirs(directory, exist_ok=True)
+        for path in glob.glob(os.path.join(glob.escape(directory), "*.[0-9][0-9][0-9][0-9][0-9].npz")) + glob.glob(os.path.join(glob.escape(directory), NAMES)):
+            os.remove(path)
+        # cid/teamid -> code, in order of appearance so that the codes never change
+        self._codes = {}
+        self._names = []
+        self._namesWritten = 0
+        # event -> {column: [values]}
+        self._buffers = {}
+        self._parts = {}
+        # last turn_id seen: the next events belong to the turn after it
+        self._turn = 0
+
+    def _code(self, name):
+        if name is None or name == "None":
+            return -1
+        name = str(name)
+        code = self._codes.get(name)
+        if code is None:
+            code = self._codes[name] = len(self._names)
+            self._names.append(name)
+        return code
+
+    def _row(self, key, value):
+        if key == "gold":
+            # {cid: gold}
+            (cid, gold), = value.items()
+            return {"cid": self._code(cid), "gold": gold}
+        row = {}
+        for column, kind in SCHEMAS[key]:
+            field = value.get(column)
+            if kind == "name":
+                row[column] = self._code(field)
+            elif column == "action":
+                row[column] = -1 if field in (None, "None") else int(field)
+            else:
+                row[column] = field
+        return row
+
+    def append(self, events):
+        """Add (timestamp, key, value) events, in the order they were logged."""
+        for timestamp, key, value in events:
+            if key not in SCHEMAS:
+                continue
+            if key == "turn_id":
+                self._turn = value
+                turn = value
+            else:
+                turn = self._turn + 1
+            buffer = self._buffers.get(key)
+            if buffer is None:
+                buffer = self._buffers[key] = {column: [] for column in ["t", "turn"] + [column for column, _ in SCHEMAS[key]]}
+            buffer["t"].append(timestamp)
+            buffer["turn"].append(turn)
+            if key != "turn_id":
+                for column, field in self._row(key, value).items():
+                    buffer[column].append(field)
+            if len(buffer["t"]) >= self._partSize:
+                self._writePart(key)
+
+    def _writePart(self, key):
+        buffer = self._buffers.pop(key, None)
+        if not buffer or not buffer["t"]:
+            return
+        columns = {column: np.array(values, dtype=columnType(key, column)) for column, values in buffer.items()}
+        part = self._parts.get(key, 0)
+        self._parts[key] = part + 1
+        self._writeNames()
+        # renamed once complete: readers never see a partial part
+        path = os.path.join(self._directory, PART_PATTERN % (key, part))
+        with open(path + ".tmp", "wb") as f:
+            np.savez(f, **columns)
+        os.replace(path + ".tmp", path)
+
+    def _writeNames(self):
+        # written before the parts that use the new codes
+        if self._namesWritten == len(self._names):
+            return
+        path = os.path.join(self._directory, NAMES)
+        with open(path + ".tmp", "wb") as f:
+            np.save(f, np.array(self._names, dtype=str))
+        os.replace(path + ".tmp", path)
+        self._namesWritten = len(self._names)
+
+    def flush(self):
+        """Write the buffered rows as new parts (small parts if called often)."""
+        for key in list(self._buffers):
+            self._writePart(key)
+        self._lastFlush = time.time()
+
+    def flushIfDue(self):
+        if self._flushInterval is not None and time.time() - self._lastFlush >= self._flushInterval:
+            self.flush()
+
+    def close(self):
+        self.flush()
+
+
+def partPaths(directory, event):
+    return sorted(glob.glob(os.path.join(glob.escape(directory), glob.escape(event) + ".[0-9][0-9][0-9][0-9][0-9].npz")))
+
+
+def readNames(directory):
+    """Array of the cids and teamids: readNames(d)[code] (code -1 is None)."""
+    return np.load(os.path.join(directory, NAMES))
+
+
+def readColumns(directory, event, columns=None):
+    """{column: array} of an event table, only the requested columns are read."""
+    parts = [np.load(path) for path in partPaths(directory, event)]
+    if columns is None:
+        columns = ["t", "turn"] + [column for column, _ in SCHEMAS[event]]
+    try:
+        return {column: np.concatenate([part[column] for part in parts]) if parts else np.empty(0, columnType(event, column)) for column in columns}
+    finally:
+        for part in parts:
+            part.close()
+
+
+def exportColumns(source, directory, partSize=1000000):
+    """Convert a log (basename of data.NNNNN.jsonl, or data.json) into columnar parts."""
+    writer = ColumnarWriter(directory, partSize)
+    events = readEvents(source) if not source.endswith(".json") else loadEvents(source)
+    batch = []
+    for event in events:
+        batch.append(event)
+        if len(batch) >= 10000:
+            writer.append(batch)
+            batch = []
+    writer.append(batch)
+    writer.close()
+    return writer
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the game events to columnar .npz parts")
+    parser.add_argument("log", help="data.json or the basename of an event log (data)")
+    parser.add_argument("directory")
+    parser.add_argument("--part-size", type=int, default=1000000)
+    args = parser.parse_args()
+
+    exportColumns(args.log, args.directory, args.part_size)
+    for event in SCHEMAS:
+        print("%-12s %d rows" % (event, len(readColumns(args.directory, event, ["t"])["t"])))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,206 @@
 import time
 import json
+import queue
+import threading
+from eventlog import *
+
+# markers in the writer queue: write the current batch now / stop the writer
+_FLUSH = object()
+_CLOSE = object()
 
 class Data:
-    def __init__(self):
-        self._history = {}
-        self._filename = "data.json"
+    """Game event recorder.
+
+    addData() only enqueues the event; a background thread writes the
+    events to the log in batches so that disk latency never delays a turn.
+    When the queue is full, addData() blocks until the writer catches up.
+    With a columnarDir, the same thread also writes the events as columnar
+    parts (see columnar.py, which needs numpy), at least every
+    columnarInterval seconds.
+    """
+
+    def __init__(self, basename="data", maxQueueSize=100000, batchSize=1000, flushInterval=0.5, columnarDir=None, columnarInterval=10.0, columnarPartSize=100000):
+        self._basename = basename
+        self._log = EventLogWriter(basename)
+        self._columnar = None
+        if columnarDir:
+            # numpy is only needed when the columnar export is enabled
+            from columnar import ColumnarWriter
+            self._columnar = ColumnarWriter(columnarDir, columnarPartSize, columnarInterval)
+        self._queue = queue.Queue(maxQueueSize)
+        self._batchSize = batchSize
+        self._flushInterval = flushInterval
+        # guards _writer and _closed, held while an event is enqueued so that
+        # no event can end up behind the close marker
+        self._writerLock = threading.Lock()
+        self._writer = None
+        # set by close(): the events are then written right away, see open()
+        self._closed = False
+        # called with (key, value) by addData, on the caller's thread
+        self._listeners = []
+        # time spent in addData per calling thread, measured only when timing
+        # is enabled (see Engine.addTurnListener)
+        self._timing = False
+        self._addTime = threading.local()
+
+    def _ensureWriterLocked(self):
+        # called with _writerLock held
+        if self._writer is None or not self._writer.is_alive():
+            self._writer = threading.Thread(target=self._writeLoop, name="data-writer", daemon=True)
+            self._writer.start()
+
+    def _writeLoop(self):
+        batch = []
+        # queue items taken but not yet acknowledged, markers included
+        taken = 0
+        closing = False
+        deadline = time.time() + self._flushInterval
+        while not closing:
+            flushNow = False
+            try:
+                event = self._queue.get(timeout=max(0.0, deadline - time.time()))
+                taken += 1
+                if event is _CLOSE:
+                    closing = True
+                elif event is _FLUSH:
+                    flushNow = True
+                else:
+                    batch.append(event)
+            except queue.Empty:
+                pass
+            if flushNow or closing or len(batch) >= self._batchSize or time.time() >= deadline:
+                if batch:
+                    self._write(batch)
+                    batch = []
+                if self._columnar is not None and not closing:
+                    self._columnar.flushIfDue()
+                if closing:
+                    self._log.close()
+                    if self._columnar is not None:
+                        self._columnar.close()
+                else:
+                    self._log.flush()
+                # task_done only once written, so that flush() can rely on join()
+                for _ in range(taken):
+                    self._queue.task_done()
+                taken = 0
+                deadline = time.time() + self._flushInterval
+
+    def _write(self, events):
+        self._log.append(events)
+        if self._columnar is not None:
+            self._columnar.append(events)
+
+    def addListener(self, listener):
+        """Register listener(key, value), called for every event; it must be fast."""
+        self._listeners = self._listeners + [listener]
+
+    def setTiming(self, enabled):
+        self._timing = enabled
+
+    def takeAddTime(self):
+        """Seconds spent in addData by the calling thread since its last call
+        (0 if timing is disabled): the events added by other threads meanwhile
+        are not counted."""
+        addTime = getattr(self._addTime, "value", 0.0)
+        self._addTime.value = 0.0
+        return addTime
 
     def addData(self, key, value):
-        if not key in self._history:
-            self._history[key] = []    
-        self._history[key].append((time.time(), value))
+        if self._timing:
+            start = time.perf_counter()
+            self._addData(key, value)
+            addTime = self._addTime
+            addTime.value = getattr(addTime, "value", 0.0) + time.perf_counter() - start
+        else:
+            self._addData(key, value)
+
+    def _addData(self, key, value):
+        event = (time.time(), key, value)
+        with self._writerLock:
+            if self._closed:
+                # no writer after close(): write it now rather than lose it
+                self._write([event])
+                self._log.flush()
+                if self._columnar is not None:
+                    self._columnar.flush()
+            else:
+                self._ensureWriterLocked()
+                # blocks while the queue is full, the writer does not need the lock
+                self._queue.put(event)
+        for listener in self._listeners:
+            listener(key, value)
+
+    def save(self):
+        # never blocks: asks the writer to write its current batch right away
+        # (if the queue is full, the writer is already busy writing)
+        if self._writer is None:
+            return
+        try:
+            self._queue.put_nowait(_FLUSH)
+        except queue.Full:
+            pass
+
+    def flush(self):
+        """Block until every event added so far has been written."""
+        if self._writer is not None:
+            self._queue.put(_FLUSH)
+        self._queue.join()
+
+    def open(self):
+        """Write the events from the background thread again after close()."""
+        with self._writerLock:
+            self._closed = False
+
+    def close(self):
+        """Drain the queue and stop the writer.
+
+        Until open() is called, the events added later are written
+        synchronously by addData().
+        """
+        with self._writerLock:
+            self._closed = True
+            writer = self._writer
+            self._writer = None
+            if writer is not None and writer.is_alive():
+                self._queue.put(_CLOSE)
+                writer.join()
+
+    def getHistory(self):
+        # rebuilt from the log, so flush first to include the latest events
+        self.flush()
+        return readHistory(self._basename)
+
+
+class NullData(Data):
+    """Data that persists nothing (headless games, replays).
+
+    The listeners still receive every event, so the turn index and the
+    metrics keep working.
+    """
+
+    def __init__(self):
+        self._basename = None
+        self._writer = None
+        self._listeners = []
+        self._timing = False
+        self._addTime = threading.local()
+
+    def _addData(self, key, value):
+        for listener in self._listeners:
+            listener(key, value)
 
     def save(self):
-        f = open(self._filename, "w")
-        toWrite = json.dumps(self._history)
-        f.write(toWrite)
-        f.close()
+        pass
+
+    def open(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
 
     def getHistory(self):
-        return self._history
+        return {}
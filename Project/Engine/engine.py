@@ -3,43 +3,241 @@ from character import *
 from action import *
 from arena import *
 from data import *
+from resolver import *
+from history import *
+from broadcast import *
+from turnindex import *
+from logger import getLogger
+from concurrent.futures import Future
+import cProfile
+import os
+import random
+import threading
 import time
 import json
 
+log = getLogger("engine")
+
+# only one profiler can be active per process (Python 3.12+ raises otherwise):
+# a turn played while another one is profiled is not profiled
+_profilerLock = threading.Lock()
 
 
 class Engine:
-    def __init__(self, minPlayersToStart :int = 2, characterTimeout :int = 5):
+    """Game engine.
+
+    Concurrency model: a turn is resolved by single_run() while holding the
+    turn lock. Mutations coming from other threads (addPlayer, removePlayer,
+    setActionTo, setTargetTo) are applied right away between turns, and
+    queued while a turn is being resolved so that they apply to the next
+    one instead of racing it. Readers (getPlayerByName, getPlayerIds,
+    getState, ...) never wait for a turn: they read the arena index or a
+    copy of the roster taken under the arena lock. getSnapshot() copies the
+    characters under the mutation lock, which a turn only holds to start,
+    and to apply the queued mutations and record itself (see _recordTurn).
+    """
+
+    def __init__(self, minPlayersToStart :int = 2, characterTimeout :int = 5, resolver :str = "python", historySize :int = 100, keyframeInterval :int = 50, statusTurns :int = 10000, dataName :str = "data", seed=None, profileSlowTurns=None, profileDir :str = "profiles", persist :bool = True, columnarDir=None, recordTurns :bool = True):
         self._turnId = 0
-        # data about the game
-        self._data = Data()
-        # state of the arena and characters' characteristics at each round
-        self._history = {}
+        # data about the game, not written anywhere when persist is False;
+        # also exported as columnar parts in columnarDir when set
+        self._data = Data(dataName, columnarDir=columnarDir) if persist else NullData()
+        # state of the arena and characters' characteristics at each round,
+        # for the last historySize rounds
+        self._history = TurnHistory(historySize)
+        # a full state is sent (and logged) every keyframeInterval rounds, deltas otherwise
+        self._keyframeInterval = keyframeInterval
+        # when False (headless games), no snapshot, history or state_* event is
+        # prepared after each turn; getSnapshot() still builds one on demand
+        self._recordTurns = recordTurns
         self._arena = Arena(self._data)
         self._run = False
         self._goldBook = {}
         self._ipMap = {}
         #### parameters ####
         self._minPlayersToStart = minPlayersToStart
+        # seconds given to the characters to send their actions before the
+        # turn is resolved without the missing ones
         self._characterTimeout = characterTimeout
+        # random stream used for the dodge rolls, private to the engine; the seed
+        # is logged with start_game so that a game can be replayed (see replay.py)
+        if seed is None:
+            seed = random.SystemRandom().getrandbits(63)
+        self._seed = seed
+        self._rng = random.Random(seed)
+        # "python" resolves the attacks one by one, "numpy" uses NumpyResolver,
+        # any object with a resolve() method (e.g. a ProcessResolver) is used as is
+        if resolver == "python":
+            self._resolver = None
+        elif resolver == "numpy":
+            self._resolver = NumpyResolver()
+        elif hasattr(resolver, "resolve"):
+            self._resolver = resolver
+        else:
+            raise ValueError("Unknown resolver: " + str(resolver))
+        #### concurrency ####
+        # held while a turn is resolved
+        self._turnLock = threading.Lock()
+        # protects _inTurn and _queuedMutations, serializes the mutations
+        self._mutationLock = threading.Lock()
+        self._inTurn = False
+        self._queuedMutations = []
+        # notified at the end of each turn (long-polling readers)
+        self._turnChanged = threading.Condition()
+        # (key, state, body, etag) of the last snapshot, built by the first reader
+        # that needs it (see getSnapshot()); one reader builds it at a time
+        self._snapshot = None
+        self._snapshotLock = threading.Lock()
+        # (turnId, state, body, etag) of the last recorded turn, read during a turn
+        self._recordedSnapshot = None
+        #### turn results ####
+        # damage/death/gold/leave events of the last statusTurns turns
+        self._turnIndex = TurnIndex(statusTurns)
+        self._data.addListener(self._turnIndex.onEvent)
+        self._broadcaster = TurnBroadcaster()
+        # called with [(character, target)] for the characters that flew away
+        self._flyHandler = None
+        #### instrumentation ####
+        # called with the phase durations and action counts of each turn played by runTurn()
+        self._turnListeners = []
+        # stats of the last turn, completed by runTurn()
+        self._turnStats = None
+        # perf_counter() at the end of the last turn, to measure the wait for actions
+        self._lastTurnEnd = None
+        # when set, turns longer than this many seconds are profiled and dumped in profileDir
+        self._profileSlowTurns = profileSlowTurns
+        self._profileDir = profileDir
+
+    def _submit(self, mutation):
+        # apply now, or after the current turn if one is being resolved (then return True)
+        with self._mutationLock:
+            if self._inTurn:
+                self._queuedMutations.append(mutation)
+                return True
+            return mutation()
+
+    def _submitAll(self, mutations):
+        # same as _submit, but all the mutations are applied together
+        with self._mutationLock:
+            if self._inTurn:
+                self._queuedMutations.extend(mutations)
+                return [True] * len(mutations)
+            return [mutation() for mutation in mutations]
+
+    def _submitAndWait(self, mutation):
+        # same as _submit, but a queued mutation is waited for: always returns its result
+        future = Future()
+        def run():
+            try:
+                future.set_result(mutation())
+            except Exception as e:
+                future.set_exception(e)
+        self._submit(run)
+        return future.result()
+
+    def _submitBatch(self, prepare, apply):
+        # prepare() -> (errors, items), then apply(item) for each item if every error is None
+        def batch():
+            errors, items = prepare()
+            if any(error is not None for error in errors):
+                return errors, None
+            return errors, [apply(item) for item in items]
+        return self._submitAndWait(batch)
+
+    def isResolvingTurn(self):
+        return self._inTurn
 
     def setActionTo(self, cid, action):
-        return self._arena.setActionTo(cid, action)
+        return self._submit(lambda: self._arena.setActionTo(cid, action))
 
     def setTargetTo(self, cid, target):
-        return self._arena.setTargetTo(cid, target)
+        return self._submit(lambda: self._arena.setTargetTo(cid, target))
+
+    def setActionsTo(self, changes):
+        # changes: (cid, action, target) tuples, None leaves the field unchanged;
+        # all of them are applied together (or queued together for the next turn)
+        return self._submitAll([lambda c=change: self._setActionAndTarget(*c) for change in changes])
+
+    def setActionsChecked(self, prepare):
+        """Validate and apply (cid, action, target) changes together, between two turns.
+
+        prepare() is called under the mutation lock and returns (errors,
+        changes), one error (None when valid) per item; the changes are
+        applied right after, with the same lock held, unless there is an
+        error. Waits for the end of the turn being resolved, if any. Returns
+        (errors, results), results being None when nothing was applied and
+        False for a change whose character is not in the arena anymore.
+        """
+        return self._submitBatch(prepare, lambda change: self._setActionAndTarget(*change))
+
+    def _setActionAndTarget(self, cid, action, target):
+        flag = True
+        if target is not None:
+            flag &= self._arena.setTargetTo(cid, target)
+        if action is not None:
+            flag &= self._arena.setActionTo(cid, action)
+        return flag
 
     def getPlayerByName(self, cid):
         return self._arena.getPlayerByName(cid)
 
-    def addPlayer(self, character, ip):
+    def getPlayerIds(self):
+        return self._arena.getPlayerIds()
+
+    def getActiveNbPlayer(self):
+        return self._arena.getActiveNbPlayer()
+
+    def getPendingPlayers(self):
+        return self._arena.getPendingPlayers()
+
+    def removePlayer(self, character):
+        self._submit(lambda: self._arena.removePlayer(character))
+
+    def addPlayer(self, character, ip, gold=None):
+        # gold: amount the character brings from another arena
+        self._submit(lambda: self._addPlayer(character, ip, gold))
+
+    def addPlayers(self, characters, ip):
+        # all the characters enter the arena together
+        self._submitAll([lambda c=character: self._addPlayer(c, ip) for character in characters])
+
+    def addPlayersChecked(self, prepare, ip):
+        """Same as setActionsChecked, prepare() returning (errors, characters) to add."""
+        return self._submitBatch(prepare, lambda character: self._addPlayer(character, ip))
+
+    def _addPlayer(self, character, ip, gold=None):
         self._arena.addPlayer(character)
         cId = character.getId()
         self._ipMap[cId] = ip
-        if not cId in self._goldBook:
+        if gold is not None:
+            self._goldBook[cId] = gold
+        elif not cId in self._goldBook:
             self._goldBook[cId] = 0
         self._data.addData("enter_arena", character.toDict())
         self._data.addData("gold", {cId : self._goldBook[cId]})
+        return True
+
+    def getGold(self, cid):
+        return self._goldBook.get(cid, 0)
+
+    def getCharacterTimeout(self):
+        return self._characterTimeout
+
+    def setFlyHandler(self, handler):
+        """handler([(character, target), ...]) is called after each turn with the
+        characters that used FLY, once they left this arena."""
+        self._flyHandler = handler
+
+    def addTurnListener(self, listener):
+        """listener(stats) is called after each turn played by runTurn() with
+        {"turn", "phases": {phase: seconds}, "counts": {kind: number}}."""
+        self._turnListeners = self._turnListeners + [listener]
+        # measure the time spent logging events
+        self._data.setTiming(True)
+
+    def addEventListener(self, listener):
+        """listener(key, value) is called for each event logged by this engine."""
+        self._data.addListener(listener)
 
     def getIP(self, cid):
         if cid in self._ipMap:
@@ -55,25 +253,162 @@ class Engine:
         flag = self._arena.getActiveNbPlayer() >= 2
         flag &= self._arena.everyoneHasAnAction()
         return flag
+
+    def waitUntilReadyToStart(self, timeout=None):
+        # woken up by the arena each time an action, a target or the roster changes
+        return self._arena.waitFor(self.isReadyToStart, timeout)
+
+    def isOver(self):
+        # battle royale: the game ends with the last character standing
+        return self._arena.getActiveNbPlayer() < 2
+
+    def _waitForActions(self):
+        # returns True as soon as the next turn can be resolved, or once the game is over
+        if self._arena.waitFor(lambda: not self._run or self.isReady(), self._characterTimeout):
+            return True
+        # deadline reached: nobody is left to fight the winner, nor to wait for
+        if self.isOver():
+            self.endGame()
+            return True
+        # otherwise the characters without action leave the arena
+        self.removeAfkPlayers()
+        if self.isOver():
+            self.endGame()
+            return True
+        return self.isReady()
+
+    def endGame(self):
+        """Stop a game that is over, logging the winner (None if nobody is left)."""
+        alive = [character.getId() for character in self._arena.snapshotPlayers() if not character.isDead()]
+        winner = alive[0] if len(alive) == 1 else None
+        log.info("game over", extra={"fields": {"turn": self._turnId, "winner": winner}})
+        self._data.addData("end_game", {"winner": winner})
+        self.stop()
+
+    def removeAfkPlayers(self):
+        return self._submit(self._arena.removeAfkPlayers)
     
     def stop(self):
         self._data.addData("stop_game", "")
         self._run = False
+        # wake up the game loop if it is waiting for actions
+        self._arena.notifyChanged()
+        # drain the pending events before returning
+        self._data.close()
 
     def single_run(self):
+        with self._turnLock:
+            start = time.perf_counter()
+            with self._mutationLock:
+                self._inTurn = True
+            self._arena.beginTurn()
+            # filled by the resolver ("sort"), only when someone listens
+            timings = {} if self._turnListeners else None
+            # "logging" only counts the events added by this thread from here
+            self._data.takeAddTime()
+            resolved = False
+            try:
+                if self._resolver is None:
+                    leavers = self._resolveTurn(timings)
+                else:
+                    leavers = self._resolver.resolve(self._arena, self._data, self._goldBook, self._rng, timings)
+                # actions reset in bulk: the leavers leave without theirs
+                self._arena.endTurn()
+                for leaver, _ in leavers:
+                    self._arena.removePlayer(leaver)
+                self._turnId += 1
+                self._data.addData("turn_id", self._turnId)
+                if timings is not None:
+                    self._turnStats = self._collectTurnStats(start, timings)
+                resolved = True
+            finally:
+                # no-op unless the resolver failed: the arena must track the changes again
+                self._arena.endTurn()
+                # the mutations received during the turn are for the next one
+                with self._mutationLock:
+                    queued = self._queuedMutations
+                    self._queuedMutations = []
+                    try:
+                        for mutation in queued:
+                            # a failing mutation must not drop the following ones
+                            try:
+                                mutation()
+                            except Exception:
+                                log.exception("queued mutation failed", extra={"fields": {"turn": self._turnId}})
+                        # before waking up the readers, with the mutation lock
+                        # held so that no character changes while it is recorded
+                        if resolved and self._recordTurns:
+                            self._recordTurn()
+                    finally:
+                        self._inTurn = False
+            # before waking up the readers: the transfers of the leavers are
+            # already recorded when an agent sees the new turn
+            if leavers and self._flyHandler is not None:
+                try:
+                    self._flyHandler(leavers)
+                except Exception:
+                    log.exception("fly handler failed", extra={"fields": {"turn": self._turnId}})
+            with self._turnChanged:
+                self._turnChanged.notify_all()
+            self._publishTurn()
+
+    def _collectTurnStats(self, start, timings):
+        phases = {}
+        if self._lastTurnEnd is not None:
+            phases["wait"] = start - self._lastTurnEnd
+        phases["sort"] = timings.get("sort", 0.0)
+        phases["logging"] = self._data.takeAddTime()
+        resolution = time.perf_counter() - start
+        phases["combat"] = max(0.0, resolution - phases["sort"] - phases["logging"])
+        phases["turn"] = resolution
+        counts = {"attacks": 0, "blocks": 0, "dodges": 0, "deaths": 0}
+        for event in self._turnIndex.get(self._turnId) or []:
+            if event["type"] == "damage":
+                counts["attacks"] += 1
+                # reduced/dodged can be 0 for a block or a dodge: count the outcome
+                outcome = event["data"].get("outcome")
+                if outcome == "blocked":
+                    counts["blocks"] += 1
+                elif outcome == "dodged":
+                    counts["dodges"] += 1
+            elif event["type"] == "death":
+                counts["deaths"] += 1
+        return {"turn": self._turnId, "phases": phases, "counts": counts}
+
+    def getTurnEvents(self, turnId):
+        """damage/death/gold/leave_arena events of a turn, None if unknown."""
+        return self._turnIndex.get(turnId)
+
+    def _publishTurn(self):
+        if self._broadcaster.getNbSubscribers() == 0:
+            return
+        # serialized once for all the subscribers
+        turnId = self._turnId
+        self._broadcaster.publish(json.dumps({"round": turnId, "events": self._turnIndex.get(turnId) or []}))
+
+    def subscribe(self):
+        """Subscription receiving the JSON results of every following turn."""
+        return self._broadcaster.subscribe()
+
+    def unsubscribe(self, subscription):
+        self._broadcaster.unsubscribe(subscription)
+
+    def _resolveTurn(self, timings=None):
         # execution of each character's action
         leavers = []
         # sort the players by speed
-        self._arena._playersList.sort(key=lambda x: x.getSpeed(), reverse=True)
-        for i in range(self._arena.getTotalNbPlayer()):
+        sortStart = time.perf_counter()
+        self._arena.sortPlayersBySpeed()
+        if timings is not None:
+            timings["sort"] = time.perf_counter() - sortStart
+        for character in self._arena.getPlayers():
             # process damage
-            character = self._arena.getPlayerByIndex(i)
             # if the character is dead, we do not need to play with him
             if not character.isDead():
                 statistics = {}
                 action, targetId = character.getAction()
                 target = self._arena.getPlayerByName(targetId)
-                if action == ACTION.HIT and not target.isDead():
+                if action == ACTION.HIT and target is not None and not target.isDead():
                     statistics["character"] = character.getId()
                     statistics["target"] = target.getId()
                     tLife = target.getLife()
@@ -87,25 +422,29 @@ class Engine:
                         statistics["damage"] = reducedDamages
                         statistics["reduced"] = cStrength - reducedDamages
                         statistics["dodged"] = 0
+                        statistics["outcome"] = "blocked"
 
                     elif tAction == ACTION.DODGE:
                         # There is a speed/25 chance to dodge an attack (means that there is 80% dodge chance at 20 speed)
                         tSpeed = target.getSpeed()
-                        r = randint(0, 25)
+                        r = self._rng.randint(0, 25)
                         statistics["damage"] = 0
                         statistics["reduced"] = 0
                         statistics["dodged"] = 0
                         if r <= tSpeed:
                             statistics["dodged"] = cStrength
+                            statistics["outcome"] = "dodged"
                         else:
                             target.setLife(tLife - cStrength)
                             statistics["damage"] = cStrength
+                            statistics["outcome"] = "hit"
 
                     else:
                         target.setLife(tLife - cStrength)
                         statistics["damage"] = cStrength
                         statistics["reduced"] = 0
                         statistics["dodged"] = 0
+                        statistics["outcome"] = "hit"
                     self._data.addData("damage", statistics)
 
                     # earn gold if the character killed someone
@@ -119,42 +458,170 @@ class Engine:
                     
                     # move to another arena
                 elif action == ACTION.FLY:
-                    leavers.append(character)
-            # reset the character's action and target
-            character.setAction(None)
-            character.setTarget(None)
-        for leaver in leavers:
-            self._arena.removePlayer(leaver)
-        self._turnId += 1
-        self._data.addData("turn_id", self._turnId)
+                    leavers.append((character, targetId))
+            # reset the character's action and target (a target that already played does not block nor dodge)
+            self._arena.clearAction(character)
+        return leavers
 
-    def run(self):
-        if not self._run:
-            self._run = True
-            self._data.addData("start_game", "")
-            # battleroyal, we continue the fight until there is only 1 character left
-            while self._run:
-                self.single_run()
-                # save logs
-                self._data.save()
-                while not self.isReady():
-                    # At some point, remove characters that take too long to send their next action
-                    time.sleep(self._characterTimeout)
-                    # remove inactive characters
-                    # self._arena.removeAfkPlayers()
-        else:
+    def start(self):
+        # the turns are then played by run(), or by an ArenaManager calling runTurn()
+        if self._run:
             raise Exception("Game is already running !")
+        self._run = True
+        # stop() closed the data of a previous game
+        self._data.open()
+        self._data.addData("start_game", {"seed": self._seed})
+        if self._recordTurns:
+            with self._mutationLock:
+                self._recordTurn()
+        self._lastTurnEnd = time.perf_counter()
+
+    def runTurn(self):
+        profiler = None
+        if self._profileSlowTurns is not None and _profilerLock.acquire(blocking=False):
+            profiler = cProfile.Profile()
+        start = time.perf_counter()
+        self._turnStats = None
+        try:
+            if profiler is not None:
+                profiler.enable()
+            self.single_run()
+            # save logs
+            saveStart = time.perf_counter()
+            self._data.save()
+            end = time.perf_counter()
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                _profilerLock.release()
+        if profiler is not None and end - start > self._profileSlowTurns:
+            self._dumpProfile(profiler, end - start)
+        stats = self._turnStats
+        if stats is not None:
+            stats["phases"]["save"] = end - saveStart
+            for listener in self._turnListeners:
+                listener(stats)
+        self._lastTurnEnd = time.perf_counter()
+
+    def _dumpProfile(self, profiler, duration):
+        os.makedirs(self._profileDir, exist_ok=True)
+        path = os.path.join(self._profileDir, "%s-turn-%d.prof" % (os.path.basename(self._data._basename or "engine"), self._turnId))
+        profiler.dump_stats(path)
+        log.warning("slow turn profiled", extra={"fields": {"turn": self._turnId, "seconds": round(duration, 4), "profile": path}})
+
+    def run(self):
+        self.start()
+        # battleroyal, we continue the fight until there is only 1 character left
+        while self._run:
+            self.runTurn()
+            while self._run and not self._waitForActions():
+                pass
+        # flush the remaining events (stop_game) and release the log
+        self._data.close()
 
     def isRunning(self):
         return self._run
     
+    def getSeed(self):
+        return self._seed
+
+    def getTurnId(self):
+        return self._turnId
+
+    def getSnapshot(self):
+        """Return (state, body, etag) for the arena as of the last resolved turn.
+
+        state is Arena.toDict() plus "round", body its JSON encoding. They are
+        built by the first reader after each turn or roster change, never by
+        the turn itself, and shared by every reader: do not modify them.
+        While a turn is being resolved, the last recorded turn is returned.
+        """
+        key = (self._turnId, self._arena.getRosterVersion())
+        cached = self._snapshot
+        if cached is not None and cached[0] == key:
+            return cached[1:]
+        with self._snapshotLock:
+            cached = self._snapshot
+            # the characters cannot change while they are copied, nor a turn start
+            with self._mutationLock:
+                inTurn = self._inTurn
+                if not inTurn:
+                    key = (self._turnId, self._arena.getRosterVersion())
+                    if cached is None or cached[0] != key:
+                        state = self._arena.toDict()
+            if inTurn:
+                return self._getRecordedSnapshot(cached)
+            if cached is None or cached[0] != key:
+                state["round"] = key[0]
+                cached = self._snapshot = (key, state, json.dumps(state), "%d-%d" % key)
+            return cached[1:]
+
+    def _getRecordedSnapshot(self, cached):
+        # called during a turn: the last recorded turn if it is more recent than the cached snapshot
+        turnId, latest = self._history.getLatest()
+        if turnId is None or (cached is not None and cached[0][0] >= turnId):
+            if cached is not None:
+                return cached[1:]
+            # nothing recorded yet (recordTurns is False): copy the arena as it is
+            state = self._arena.toDict()
+            state["round"] = self._turnId
+            return state, json.dumps(state), "%d-%d" % (self._turnId, self._arena.getRosterVersion())
+        recorded = self._recordedSnapshot
+        if recorded is None or recorded[0] != turnId:
+            state = {"arena": list(latest.values()), "round": turnId}
+            recorded = self._recordedSnapshot = (turnId, state, json.dumps(state), str(turnId))
+        return recorded[1:]
+
+    def waitForTurn(self, since, timeout=None):
+        """Block until a turn after `since` is resolved; False on timeout."""
+        with self._turnChanged:
+            return self._turnChanged.wait_for(lambda: self._turnId > since, timeout)
+
+    def _recordTurn(self):
+        # called with the mutation lock held; only the characters that changed are looked at
+        turnId = self._turnId
+        previousTurn, previous = self._history.getLatest()
+        if previousTurn is not None and turnId <= previousTurn:
+            # already recorded (game restarted): the changes go to the next turn
+            return
+        changed, removed = self._arena.takeChanges()
+        if previousTurn is None:
+            diff = self._history.record(turnId, [character.toDict() for character in self._arena.snapshotPlayers()])
+        else:
+            # a character whose action was set then reset keeps its recorded dict
+            dicts = [character.toDict() for character in changed if not (character.getId() in previous and character.reuseDict(previous[character.getId()]))]
+            diff = self._history.recordChanges(turnId, dicts, removed)
+        # log the turn as a delta against the previous one, with periodic keyframes
+        if previousTurn is None or turnId % self._keyframeInterval == 0:
+            self._data.addData("state_keyframe", {"round": turnId, "arena": list(self._history.getLatest()[1].values())})
+        elif diff is not None:
+            self._data.addData("state_delta", {"round": turnId, "since": previousTurn, "changed": diff["changed"], "removed": diff["removed"]})
+
+    def getDelta(self, since=None):
+        """Characters that changed since round `since`, as a dict.
+
+        {"type": "delta", "since", "round", "changed": {cid: changed fields
+        (all of them for a new character)}, "removed": [cid, ...]}, or a
+        {"type": "keyframe", "round", "arena"} full state when `since` is
+        None, no longer retained, or more than keyframeInterval rounds old.
+        """
+        latestTurn, latest = self._history.getLatest()
+        if latestTurn is None:
+            state, _, _ = self.getSnapshot()
+            return {"type": "keyframe", "round": state["round"], "arena": state["arena"]}
+        delta = None
+        if since is not None and latestTurn - since <= self._keyframeInterval:
+            delta = self._history.changesSince(since)
+        if delta is None:
+            return {"type": "keyframe", "round": latestTurn, "arena": list(latest.values())}
+        return {"type": "delta", "since": since, "round": latestTurn, "changed": delta["changed"], "removed": delta["removed"]}
+
     # get an observation of the arena that will be sent to every agents
     def getState(self):
-        arena_data = self._arena.toDict()
-        arena_data["round"] = self._turnId
-        self._history[self._turnId] = arena_data
-        return json.dumps(arena_data)
+        _, body, _ = self.getSnapshot()
+        return body
 
-    def getStates(self):
-        return json.dumps(self._history)
+    def getStates(self, first=None, last=None):
+        # only the retained rounds in [first, last] are rebuilt and serialized
+        return json.dumps(self._history.getRange(first, last))
             
@@ -0,0 +1,116 @@
+import glob
+import json
+import os
+import time
+
+# one event per line: {"t": timestamp, "k": key, "v": value}
+SEGMENT_PATTERN = "%s.%05d.jsonl"
+
+
+def segmentPaths(basename):
+    """Return the segments of a log, oldest first."""
+    return sorted(glob.glob(glob.escape(basename) + ".[0-9][0-9][0-9][0-9][0-9].jsonl"))
+
+
+class EventLogWriter:
+    """Append-only JSON Lines writer with size based segment rotation.
+
+    Only the events handed to append() are written, so the cost of a flush
+    depends on what happened since the previous one, not on the game length.
+    """
+
+    def __init__(self, basename="data", maxSegmentSize=16 * 1024 * 1024, fsyncInterval=1.0):
+        self._basename = basename
+        self._maxSegmentSize = maxSegmentSize
+        self._fsyncInterval = fsyncInterval
+        self._lastFsync = time.time()
+        # a new writer starts a new game log, like data.json used to be rewritten
+        for path in segmentPaths(basename):
+            os.remove(path)
+        self._segment = 0
+        self._file = None
+        self._size = 0
+        self._open()
+
+    def _open(self):
+        self._file = open(SEGMENT_PATTERN % (self._basename, self._segment), "a", encoding="utf-8")
+        self._size = self._file.tell()
+
+    def _rotate(self):
+        self._sync()
+        self._file.close()
+        self._segment += 1
+        self._open()
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._lastFsync = time.time()
+
+    def append(self, events):
+        """Write (timestamp, key, value) events at the end of the current segment."""
+        if self._file is None:
+            # reopened after close(): keep appending to the last segment
+            self._open()
+        for timestamp, key, value in events:
+            line = json.dumps({"t": timestamp, "k": key, "v": value}) + "\n"
+            if self._size > 0 and self._size + len(line) > self._maxSegmentSize:
+                self._rotate()
+            self._file.write(line)
+            self._size += len(line)
+
+    def flush(self, fsync=False):
+        if self._file is None:
+            return
+        self._file.flush()
+        if fsync or time.time() - self._lastFsync >= self._fsyncInterval:
+            self._sync()
+
+    def close(self):
+        if self._file is not None:
+            self._sync()
+            self._file.close()
+            self._file = None
+
+
+def readEvents(basename):
+    """Iterate over (timestamp, key, value) for every event of a log."""
+    for path in segmentPaths(basename):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    # a line cut by a crash can only be the last one of the log
+                    break
+                yield event["t"], event["k"], event["v"]
+
+
+def loadEvents(path):
+    """(timestamp, key, value) of a log or of a legacy data.json, in the order they were recorded."""
+    if path.endswith(".json"):
+        with open(path, encoding="utf-8") as f:
+            history = json.load(f)
+        # the old data.json groups the events by key: merge them back by time
+        events = [(timestamp, key, value) for key, entries in history.items() for timestamp, value in entries]
+        events.sort(key=lambda event: event[0])
+        return events
+    return list(readEvents(path))
+
+
+def readHistory(basename):
+    """Rebuild the {key: [[timestamp, value], ...]} shape of the old data.json.
+
+    A legacy data.json (or any plain .json file) is loaded as is.
+    """
+    if basename.endswith(".json") and os.path.isfile(basename):
+        with open(basename, encoding="utf-8") as f:
+            return json.load(f)
+    history = {}
+    for timestamp, key, value in readEvents(basename):
+        if not key in history:
+            history[key] = []
+        history[key].append([timestamp, value])
+    return history
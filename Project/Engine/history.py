@@ -0,0 +1,185 @@
+from collections import deque
+import threading
+
+
+class TurnHistory:
+    """Arena states of the last `maxTurns` turns.
+
+    Only the oldest retained state is stored in full; every later turn is
+    stored as a diff against the previous one (changed fields of the
+    characters that changed, full dict for the new ones, cids of the ones
+    that left). When the buffer is full, the oldest diff is folded into
+    the base state.
+
+    record() is called by the engine thread while API threads read: readers
+    take (base, diffs) under the lock and work on that copy. The states and
+    diffs themselves are never modified once stored.
+    """
+
+    def __init__(self, maxTurns=100):
+        if maxTurns < 1:
+            raise ValueError("maxTurns must be at least 1")
+        self._maxTurns = maxTurns
+        self._lock = threading.Lock()
+        # (turnId, {cid: character dict}) of the oldest retained turn
+        self._base = None
+        # (turnId, diff) of the following turns, oldest first
+        self._diffs = deque()
+        # latest recorded state, to compute the next diff
+        self._last = None
+        self._lastTurn = None
+
+    @staticmethod
+    def diff(previous, current):
+        """Diff between two {cid: character dict} states."""
+        changed = {}
+        for cid, character in current.items():
+            old = previous.get(cid)
+            # character dicts are cached until a field changes (CharacterProxy.toDict)
+            if old is character:
+                continue
+            fields = character if old is None else TurnHistory._changedFields(old, character)
+            if fields:
+                changed[cid] = fields
+        removed = [cid for cid in previous if cid not in current]
+        return {"changed": changed, "removed": removed}
+
+    @staticmethod
+    def _changedFields(old, character):
+        return {key: value for key, value in character.items() if old.get(key) != value or type(old.get(key)) is not type(value)}
+
+    @staticmethod
+    def apply(state, diff):
+        """Return the state obtained by applying diff to state (state is not modified)."""
+        state = dict(state)
+        TurnHistory._applyInPlace(state, diff)
+        return state
+
+    @staticmethod
+    def _applyInPlace(state, diff):
+        # replaces the character dicts that changed, never modifies them
+        for cid in diff["removed"]:
+            state.pop(cid, None)
+        for cid, fields in diff["changed"].items():
+            if cid in state:
+                updated = dict(state[cid])
+                updated.update(fields)
+                state[cid] = updated
+            else:
+                state[cid] = fields
+
+    def record(self, turnId, characters):
+        """Store the state of a turn given as a list of character dicts; return
+        its diff against the previous turn (None for the first one)."""
+        if self._lastTurn is not None and turnId <= self._lastTurn:
+            return None
+        state = {character["cid"]: character for character in characters}
+        # computed outside the lock, only the engine thread writes
+        diff = self.diff(self._last, state) if self._base is not None else None
+        self._store(turnId, state, diff)
+        return diff
+
+    def recordChanges(self, turnId, characters, removed):
+        """Same as record(), given only the dicts of the characters that may
+        have changed since the last recorded turn and the cids that left.
+
+        The other characters are not compared (their dicts are only copied
+        by reference), so the cost mostly depends on the activity rather
+        than on the arena size. The first turn needs record().
+        """
+        if self._base is None:
+            raise ValueError("The first turn must be stored with record()")
+        if turnId <= self._lastTurn:
+            return None
+        state = dict(self._last)
+        changed = {}
+        for character in characters:
+            cid = character["cid"]
+            old = state.get(cid)
+            if old is character:
+                continue
+            fields = character if old is None else self._changedFields(old, character)
+            if fields:
+                changed[cid] = fields
+            state[cid] = character
+        removed = [cid for cid in removed if state.pop(cid, None) is not None]
+        diff = {"changed": changed, "removed": removed}
+        self._store(turnId, state, diff)
+        return diff
+
+    def _store(self, turnId, state, diff):
+        base = None
+        if diff is not None and len(self._diffs) + 1 >= self._maxTurns:
+            oldestTurn, oldestDiff = self._diffs[0]
+            base = (oldestTurn, self.apply(self._base[1], oldestDiff))
+        with self._lock:
+            if self._base is None:
+                self._base = (turnId, state)
+            else:
+                self._diffs.append((turnId, diff))
+                if base is not None:
+                    self._diffs.popleft()
+                    self._base = base
+            self._last = state
+            self._lastTurn = turnId
+
+    def _view(self):
+        # consistent (base, diffs, last turn id) for the readers
+        with self._lock:
+            return self._base, tuple(self._diffs), self._lastTurn
+
+    def getTurnIds(self):
+        base, diffs, _ = self._view()
+        if base is None:
+            return []
+        return [base[0]] + [turnId for turnId, _ in diffs]
+
+    def getLatest(self):
+        """(turnId, {cid: character dict}) of the last recorded turn."""
+        with self._lock:
+            return self._lastTurn, self._last
+
+    def changesSince(self, turnId):
+        """Diff between turnId and the last recorded turn, or None if turnId is not retained."""
+        base, diffs, lastTurn = self._view()
+        if base is None or turnId < base[0] or turnId > lastTurn:
+            return None
+        changed = {}
+        # dict used as an ordered set: cids may not be comparable with each other
+        removed = {}
+        for t, diff in diffs:
+            if t <= turnId:
+                continue
+            for cid in diff["removed"]:
+                changed.pop(cid, None)
+                removed[cid] = True
+            for cid, fields in diff["changed"].items():
+                if cid in removed:
+                    # left then came back: the diff holds its full dict
+                    del removed[cid]
+                    changed[cid] = fields
+                elif cid in changed:
+                    merged = dict(changed[cid])
+                    merged.update(fields)
+                    changed[cid] = merged
+                else:
+                    changed[cid] = fields
+        return {"changed": changed, "removed": list(removed)}
+
+    def getRange(self, first=None, last=None):
+        """{turnId: {"arena": [...], "round": turnId}} for the retained turns in [first, last]."""
+        result = {}
+        base, diffs, _ = self._view()
+        if base is None:
+            return result
+        turnId, state = base
+        state = dict(state)
+        turns = [(turnId, None)] + list(diffs)
+        for turnId, diff in turns:
+            if last is not None and turnId > last:
+                break
+            if diff is not None:
+                self._applyInPlace(state, diff)
+            if first is None or turnId >= first:
+                result[turnId] = {"arena": list(state.values()), "round": turnId}
+        return result
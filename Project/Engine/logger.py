@@ -0,0 +1,56 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+
+# level of the "arena" loggers, e.g. ARENA_LOG_LEVEL=DEBUG
+LOG_LEVEL = os.environ.get("ARENA_LOG_LEVEL", "INFO").upper()
+
+_listener = None
+_setupLock = threading.Lock()
+
+
+class StructuredFormatter(logging.Formatter):
+    """One line per record: time, level, logger, message and key=value fields."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s %(message)s")
+
+    def format(self, record):
+        s = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            s += " " + " ".join(f"{key}={value!r}" for key, value in fields.items())
+        return s
+
+
+def _setup():
+    global _listener
+    root = logging.getLogger("arena")
+    root.setLevel(LOG_LEVEL)
+    root.propagate = False
+    # the request and game threads only push records on a queue, a single
+    # listener thread does the blocking writes to stderr
+    records = queue.SimpleQueue()
+    root.addHandler(logging.handlers.QueueHandler(records))
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(StructuredFormatter())
+    _listener = logging.handlers.QueueListener(records, handler)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def getLogger(name):
+    """Return the "arena.<name>" logger.
+
+    Pass the variable parts as arguments (log.debug("... %s", x)) or in
+    extra={"fields": {...}} so that nothing is formatted when the level is
+    disabled; on hot paths, guard the call with log.isEnabledFor().
+    """
+    with _setupLock:
+        if _listener is None:
+            _setup()
+    return logging.getLogger("arena." + name)
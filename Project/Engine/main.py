@@ -10,8 +10,7 @@ app = Flask(__name__)
 engine = Engine()
 
 def run_game():
-    while not engine.isReadyToStart():
-        time.sleep(1)
+    engine.waitUntilReadyToStart()
     try:
         engine.run()
     except Exception as e:
@@ -0,0 +1,276 @@
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from engine import *
+from logger import getLogger
+from transfer import *
+import hashlib
+import random
+import threading
+import time
+
+log = getLogger("manager")
+
+
+class ArenaManager:
+    """Hosts several independent Engine/Arena instances in one process.
+
+    Arenas are keyed by an arena id. Instead of one blocking Engine.run()
+    thread per arena, a scheduler thread watches the started arenas and
+    submits Engine.runTurn() to a shared worker pool as soon as an arena is
+    ready, or when its characterTimeout deadline expires (the AFK
+    characters are then removed). A character using FLY is moved to
+    another local arena directly, without any HTTP call, or to one of the
+    `peers` servers (base URLs) with a prepare/commit transfer; if the
+    transfer fails, the character comes back to its arena.
+
+    With processes=N, the attacks are resolved in a pool of N processes
+    (ProcessResolver) so that arenas do not contend on the GIL; the worker
+    threads then mostly wait for their process. With a seed, each arena
+    gets its own RNG seeded from (seed, arena id), so a game does not
+    depend on the other arenas nor on which worker resolves it.
+    """
+
+    def __init__(self, maxWorkers=8, processes=None, seed=None, peers=None, **engineOptions):
+        self._engineOptions = engineOptions
+        self._peers = list(peers or [])
+        self._transfers = TransferClient() if self._peers else None
+        self._seed = seed
+        self._processPool = None
+        if processes:
+            self._processPool = ProcessPoolExecutor(processes)
+            # one thread per process at least, to keep them all busy
+            maxWorkers = max(maxWorkers, processes)
+        self._engines = {}
+        # arena ids started but still waiting for Engine.isReadyToStart()
+        self._waiting = set()
+        # arena ids whose turns are scheduled
+        self._running = set()
+        # arena ids with a turn in the worker pool
+        self._inFlight = set()
+        # arena id -> time after which the AFK characters are removed
+        self._deadlines = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        # arena ids that changed since the scheduler last looked at them
+        self._dirty = set()
+        self._pool = ThreadPoolExecutor(maxWorkers, thread_name_prefix="arena-turn")
+        self._closed = False
+        self._scheduler = threading.Thread(target=self._schedule, name="arena-scheduler", daemon=True)
+        self._scheduler.start()
+
+    #### arenas ####
+
+    def createArena(self, arenaId=None, **engineOptions):
+        options = dict(self._engineOptions)
+        options.update(engineOptions)
+        with self._lock:
+            if arenaId is None:
+                arenaId = "arena-%d" % (len(self._engines) + 1)
+                while arenaId in self._engines:
+                    arenaId += "-"
+            if arenaId in self._engines:
+                raise ValueError(f"Arena '{arenaId}' already exists")
+            # one event log per arena
+            options.setdefault("dataName", "data" if arenaId == "default" else "data-" + str(arenaId))
+            if self._seed is not None:
+                options.setdefault("seed", arenaSeed(self._seed, arenaId))
+            if self._processPool is not None:
+                options.setdefault("resolver", ProcessResolver(self._processPool))
+            engine = Engine(**options)
+            engine.setFlyHandler(lambda leavers, source=arenaId: self._onFly(source, leavers))
+            engine._arena.addChangeListener(lambda arenaId=arenaId: self.wakeUp(arenaId))
+            self._engines[arenaId] = engine
+        return engine
+
+    def getArena(self, arenaId):
+        return self._engines.get(arenaId)
+
+    def getArenaIds(self):
+        return list(self._engines)
+
+    def isScheduled(self, arenaId):
+        return arenaId in self._waiting or arenaId in self._running
+
+    def removeArena(self, arenaId):
+        self.stopArena(arenaId)
+        with self._lock:
+            return self._engines.pop(arenaId, None)
+
+    #### turn scheduling ####
+
+    def startArena(self, arenaId):
+        """Play the turns of an arena once it is ready to start."""
+        with self._lock:
+            if arenaId not in self._engines:
+                raise KeyError(arenaId)
+            if arenaId in self._waiting or arenaId in self._running:
+                raise Exception("Game is already running !")
+            self._waiting.add(arenaId)
+            self._dirty.add(arenaId)
+            self._wake.notify()
+
+    def stopArena(self, arenaId):
+        with self._lock:
+            self._waiting.discard(arenaId)
+            wasRunning = arenaId in self._running
+            self._running.discard(arenaId)
+            self._deadlines.pop(arenaId, None)
+            engine = self._engines.get(arenaId)
+        if wasRunning and engine is not None and engine.isRunning():
+            engine.stop()
+
+    def _endArena(self, arenaId, engine):
+        # no more turns nor deadline for a finished game
+        with self._lock:
+            if arenaId not in self._running:
+                return
+            self._running.discard(arenaId)
+            self._deadlines.pop(arenaId, None)
+        if engine.isRunning():
+            engine.endGame()
+
+    def wakeUp(self, arenaId=None):
+        # called by an arena when an action, a target or its roster changes
+        with self._lock:
+            if arenaId is not None:
+                self._dirty.add(arenaId)
+            self._wake.notify()
+
+    def _schedule(self):
+        while not self._closed:
+            with self._lock:
+                if not self._dirty:
+                    timeout = None
+                    if self._deadlines:
+                        timeout = max(0.0, min(self._deadlines.values()) - time.time())
+                    self._wake.wait(timeout)
+                now = time.time()
+                # only the arenas that changed or whose deadline expired are checked
+                expired = [a for a, deadline in self._deadlines.items() if deadline <= now]
+                candidates = self._dirty.union(expired)
+                self._dirty = set()
+                waiting = [a for a in candidates if a in self._waiting]
+                running = [a for a in candidates if a in self._running and a not in self._inFlight]
+            for arenaId in waiting:
+                engine = self._engines.get(arenaId)
+                if engine is not None and engine.isReadyToStart():
+                    engine.start()
+                    with self._lock:
+                        self._waiting.discard(arenaId)
+                        self._running.add(arenaId)
+                    self._submitTurn(arenaId, engine)
+            for arenaId in running:
+                engine = self._engines.get(arenaId)
+                if engine is None:
+                    continue
+                if not engine.isReady() and arenaId in expired:
+                    # the last character standing is not AFK: it won
+                    if not engine.isOver():
+                        engine.removeAfkPlayers()
+                    if engine.isOver():
+                        self._endArena(arenaId, engine)
+                        continue
+                    with self._lock:
+                        if arenaId in self._deadlines:
+                            self._deadlines[arenaId] = time.time() + engine.getCharacterTimeout()
+                if engine.isReady():
+                    self._submitTurn(arenaId, engine)
+
+    def _submitTurn(self, arenaId, engine):
+        with self._lock:
+            if arenaId in self._inFlight or arenaId not in self._running:
+                return
+            self._inFlight.add(arenaId)
+            self._deadlines.pop(arenaId, None)
+        self._pool.submit(self._runTurn, arenaId, engine)
+
+    def _runTurn(self, arenaId, engine):
+        try:
+            engine.runTurn()
+        except Exception:
+            log.exception("turn failed", extra={"fields": {"arena": arenaId}})
+        finally:
+            with self._lock:
+                self._inFlight.discard(arenaId)
+                if arenaId in self._running:
+                    self._deadlines[arenaId] = time.time() + engine.getCharacterTimeout()
+                # the actions may already be there for the next turn
+                self._dirty.add(arenaId)
+                self._wake.notify()
+
+    #### FLY ####
+
+    def _onFly(self, source, leavers):
+        for character, target in leavers:
+            destination = self.pickDestination(source, target)
+            if destination is None:
+                # nowhere to go: the character just left
+                continue
+            if destination in self._peers:
+                self.send(character, source, destination)
+            else:
+                self.migrate(character, source, destination)
+
+    def getPeers(self):
+        return list(self._peers)
+
+    def pickDestination(self, source, target):
+        """Where a character flying from `source` goes: the local arena or the
+        peer named by its FLY target, a random other arena or peer otherwise."""
+        if target is not None and target != source and (target in self._engines or target in self._peers):
+            return target
+        others = [arenaId for arenaId in self._engines if arenaId != source] + self._peers
+        if not others:
+            return None
+        return random.choice(others)
+
+    def migrate(self, character, source, destination):
+        """Move a character between two local arenas, with its gold."""
+        sourceEngine = self._engines.get(source)
+        destinationEngine = self._engines.get(destination)
+        if sourceEngine is None or destinationEngine is None:
+            return False
+        cid = character.getId()
+        sourceEngine.removePlayer(character)
+        destinationEngine.addPlayer(character, sourceEngine.getIP(cid), sourceEngine.getGold(cid))
+        log.info("fly", extra={"fields": {"cid": cid, "from": source, "to": destination}})
+        return True
+
+    def send(self, character, source, destination):
+        """Transfer a character that left `source` to the peer server `destination`."""
+        sourceEngine = self._engines.get(source)
+        if sourceEngine is None or self._transfers is None:
+            return None
+        cid = character.getId()
+        ip = sourceEngine.getIP(cid)
+        gold = sourceEngine.getGold(cid)
+        # the character is back in its arena if the destination did not take it
+        rollback = lambda: sourceEngine.addPlayer(character, ip, gold)
+        log.info("fly", extra={"fields": {"cid": cid, "from": source, "to": destination}})
+        return self._transfers.send(character.toDict(), gold, ip, destination, onFailure=rollback)
+
+    def getOutgoingTransfer(self, cid):
+        """Last transfer of a character to another server, None if there was none."""
+        if self._transfers is None:
+            return None
+        return self._transfers.getOutgoing(cid)
+
+    def forgetOutgoingTransfer(self, cid):
+        if self._transfers is not None:
+            self._transfers.forget(cid)
+
+    def close(self):
+        self._closed = True
+        for arenaId in list(self._engines):
+            self.stopArena(arenaId)
+        self.wakeUp()
+        self._pool.shutdown(wait=True)
+        if self._transfers is not None:
+            self._transfers.close()
+        if self._processPool is not None:
+            self._processPool.shutdown(wait=True)
+
+
+def arenaSeed(seed, arenaId):
+    """Seed of an arena, derived from the manager seed (stable across runs, unlike hash())."""
+    digest = hashlib.sha256(f"{seed}:{arenaId}".encode()).digest()
+    return int.from_bytes(digest[:8], "big")
@@ -0,0 +1,181 @@
+from bisect import bisect_left
+from prometheus_client import Gauge, Histogram, REGISTRY
+from prometheus_client.core import HistogramMetricFamily
+import threading
+
+
+class CharacterMetrics:
+    """Prometheus metrics of the living characters, updated from the game events.
+
+    It listens to the events of each arena (see Engine.addEventListener):
+    enter_arena sets the series of a character, damage only updates the
+    life of its target, death and leave_arena remove the series. Nothing is
+    computed at scrape time.
+
+    mode="cid": one gauge series per character and stat (labels arena, cid,
+    teamid). mode="team": one histogram per arena, team and stat instead,
+    so the number of series does not grow with the number of characters.
+    """
+
+    STATS = ("life", "strength", "armor", "speed")
+    HELP = {"life": "Vie des personnages", "strength": "Force des personnages", "armor": "Armure des personnages", "speed": "Vitesse des personnages"}
+    BUCKETS = (0, 1, 2, 3, 5, 8, 10, 13, 16, 20, float("inf"))
+
+    def __init__(self, mode="cid", registry=REGISTRY, buckets=BUCKETS):
+        if mode not in ("cid", "team"):
+            raise ValueError("Unknown character metrics mode: " + str(mode))
+        self._mode = mode
+        self._buckets = tuple(buckets)
+        if self._buckets[-1] != float("inf"):
+            self._buckets += (float("inf"),)
+        self._lock = threading.Lock()
+        # (arena, cid) -> {"teamid": ..., "life": ..., "strength": ..., ...} of the living characters
+        self._characters = {}
+        if mode == "cid":
+            self._gauges = {stat: Gauge("character_" + stat, self.HELP[stat], ["arena", "cid", "teamid"], registry=registry) for stat in self.STATS}
+        else:
+            # (arena, teamid) -> {stat: [count per bucket, ..., sum]}, plus "count"
+            self._teams = {}
+            registry.register(self)
+
+    def getMode(self):
+        return self._mode
+
+    def attach(self, arenaId, engine):
+        engine.addEventListener(lambda key, value: self.onEvent(arenaId, key, value))
+
+    def onEvent(self, arenaId, key, value):
+        if key == "enter_arena":
+            if not value["dead"]:
+                self._add(arenaId, value)
+        elif key == "damage":
+            self._damage(arenaId, value["target"], value["damage"])
+        elif key == "death":
+            self._remove(arenaId, value["character"])
+        elif key == "leave_arena":
+            self._remove(arenaId, value["cid"])
+
+    def _add(self, arenaId, character):
+        cid = character["cid"]
+        with self._lock:
+            if (arenaId, cid) in self._characters:
+                # a character coming back replaces its old entry
+                self._removeLocked(arenaId, cid)
+            stats = {stat: character[stat] for stat in self.STATS}
+            stats["teamid"] = character["teamid"]
+            self._characters[(arenaId, cid)] = stats
+            if self._mode == "cid":
+                for stat in self.STATS:
+                    self._gauges[stat].labels(arena=arenaId, cid=cid, teamid=stats["teamid"]).set(stats[stat])
+            else:
+                team = self._teams.setdefault((arenaId, stats["teamid"]), {"count": 0})
+                team["count"] += 1
+                for stat in self.STATS:
+                    self._observe(team, stat, stats[stat], 1)
+
+    def _damage(self, arenaId, cid, damage):
+        with self._lock:
+            stats = self._characters.get((arenaId, cid))
+            if stats is None:
+                return
+            # same operation as the engine, so the value is the same
+            life = stats["life"] - damage
+            if self._mode == "cid":
+                self._gauges["life"].labels(arena=arenaId, cid=cid, teamid=stats["teamid"]).set(life)
+            else:
+                team = self._teams[(arenaId, stats["teamid"])]
+                self._observe(team, "life", stats["life"], -1)
+                self._observe(team, "life", life, 1)
+            stats["life"] = life
+
+    def _remove(self, arenaId, cid):
+        with self._lock:
+            self._removeLocked(arenaId, cid)
+
+    def _removeLocked(self, arenaId, cid):
+        stats = self._characters.pop((arenaId, cid), None)
+        if stats is None:
+            return
+        if self._mode == "cid":
+            for stat in self.STATS:
+                self._gauges[stat].remove(arenaId, cid, stats["teamid"])
+        else:
+            team = self._teams[(arenaId, stats["teamid"])]
+            team["count"] -= 1
+            if team["count"] == 0:
+                del self._teams[(arenaId, stats["teamid"])]
+                return
+            for stat in self.STATS:
+                self._observe(team, stat, stats[stat], -1)
+
+    def _observe(self, team, stat, value, count):
+        # count is 1 to add a value to the histogram, -1 to take it back
+        values = team.get(stat)
+        if values is None:
+            values = team[stat] = [0] * len(self._buckets) + [0]
+        values[bisect_left(self._buckets, value)] += count
+        values[-1] += count * value
+
+    def clear(self, arenaId=None):
+        """Remove the series of an arena, or of every arena."""
+        with self._lock:
+            for key in [key for key in self._characters if arenaId is None or key[0] == arenaId]:
+                self._removeLocked(*key)
+
+    def collect(self):
+        # called by the registry at scrape time in "team" mode: one histogram per stat
+        with self._lock:
+            teams = {key: {stat: list(values) for stat, values in team.items() if stat != "count"} for key, team in self._teams.items()}
+        for stat in self.STATS:
+            family = HistogramMetricFamily("character_" + stat + "_by_team", self.HELP[stat] + " par équipe", labels=["arena", "teamid"])
+            for (arenaId, teamid), team in teams.items():
+                values = team[stat]
+                buckets = []
+                cumulative = 0
+                for bound, count in zip(self._buckets, values):
+                    cumulative += count
+                    buckets.append(("+Inf" if bound == float("inf") else str(bound), cumulative))
+                family.add_metric([str(arenaId), str(teamid)], buckets, values[-1])
+            yield family
+
+
+class TurnMetrics:
+    """Prometheus histograms of the turns (see Engine.addTurnListener).
+
+    turn_duration: resolution of a turn; turn_phase_seconds: time spent
+    waiting for the actions, sorting, in combat, logging the events and in
+    Data.save; turn_actions: attacks, blocks, dodges and deaths per turn.
+    """
+
+    PHASES = ("wait", "sort", "combat", "logging", "save")
+
+    def __init__(self, registry=REGISTRY):
+        self._duration = Histogram("turn_duration", "Durée des tours", ["arena"], buckets=[0.001, 0.01, 0.1, 0.5, 1, 2, 5, 10], registry=registry)
+        self._phases = Histogram("turn_phase_seconds", "Durée des phases des tours", ["arena", "phase"], buckets=[0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30], registry=registry)
+        self._actions = Histogram("turn_actions", "Nombre d'actions par tour", ["arena", "kind"], buckets=[0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000, 100000], registry=registry)
+
+    def attach(self, arenaId, engine):
+        engine.addTurnListener(lambda stats: self.onTurn(arenaId, stats))
+
+    def onTurn(self, arenaId, stats):
+        phases = stats["phases"]
+        self._duration.labels(arena=arenaId).observe(phases["turn"])
+        for phase in self.PHASES:
+            if phase in phases:
+                self._phases.labels(arena=arenaId, phase=phase).observe(phases[phase])
+        for kind, count in stats["counts"].items():
+            self._actions.labels(arena=arenaId, kind=kind).observe(count)
+
+    def clear(self, arenaId):
+        for phase in self.PHASES:
+            self._removeSeries(self._phases, arenaId, phase)
+        for kind in ("attacks", "blocks", "dodges", "deaths"):
+            self._removeSeries(self._actions, arenaId, kind)
+        self._removeSeries(self._duration, arenaId)
+
+    @staticmethod
+    def _removeSeries(metric, *labels):
+        try:
+            metric.remove(*labels)
+        except KeyError:
+            pass
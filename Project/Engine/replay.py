@@ -0,0 +1,132 @@
+"""Replay a recorded game offline and check that the engine reproduces it.
+
+The game is rebuilt from its log (data.json, or the data.NNNNN.jsonl
+segments): enter_arena, set_action, set_target and leave_arena are applied
+in order and each turn_id resolves a turn, with the RNG seeded with the
+seed logged by start_game. There is no HTTP, no waiting and no log
+written. The damage and death events of each replayed turn are compared
+with the recorded ones.
+
+    python replay.py data               # event log data.NNNNN.jsonl
+    python replay.py data.json --resolver numpy
+"""
+from engine import *
+from eventlog import *
+import argparse
+import json
+import sys
+import time
+
+# events produced by a turn, compared with the recording
+CHECKED_EVENTS = ("damage", "death")
+
+
+def parseAction(value):
+    # actions are logged by actionToStr ("0".."3", "None")
+    if value is None or value == "None":
+        return None
+    if value.isdigit():
+        return ACTION(int(value))
+    return ACTION[value]
+
+
+class Replay:
+    """Re-simulates a game from its events; see replay()."""
+
+    def __init__(self, resolver="python", seed=None):
+        self._engine = Engine(resolver=resolver, seed=seed, persist=False, recordTurns=False)
+        self._seeded = seed is not None
+        # events of the turn being replayed
+        self._produced = []
+        self._engine.addEventListener(self._onEvent)
+        # str(cid) -> cid, targets are logged with str()
+        self._cids = {}
+        self.turns = 0
+        self.checked = 0
+        self.mismatches = []
+
+    def _onEvent(self, key, value):
+        if key in CHECKED_EVENTS:
+            # same representation as a value read back from the log
+            self._produced.append((key, json.loads(json.dumps(value))))
+
+    def _character(self, cid):
+        return self._engine.getPlayerByName(cid)
+
+    def apply(self, key, value, recorded):
+        """Apply one recorded event; `recorded` collects the events of the current turn."""
+        engine = self._engine
+        if key == "start_game":
+            if isinstance(value, dict) and value.get("seed") is not None and not self._seeded:
+                engine._rng.seed(value["seed"])
+                self._seeded = True
+        elif key == "enter_arena":
+            character = CharacterProxy(value["cid"], value["teamid"], value["life"], value["strength"], value["armor"], value["speed"])
+            self._cids[str(value["cid"])] = value["cid"]
+            engine._addPlayer(character, None)
+        elif key == "set_action":
+            character = self._character(value["cid"])
+            if character is not None:
+                character.setAction(parseAction(value["action"]))
+        elif key == "set_target":
+            character = self._character(value["cid"])
+            if character is not None:
+                target = value["target"]
+                character.setTarget(None if target == "None" else self._cids.get(target, target))
+        elif key == "leave_arena":
+            character = self._character(value["cid"])
+            # a FLY leaver is removed by the turn itself
+            if character is not None and character.getAction()[0] != ACTION.FLY:
+                engine._arena.removePlayer(character)
+        elif key in CHECKED_EVENTS:
+            recorded.append((key, value))
+        elif key == "turn_id":
+            self._produced = []
+            engine.single_run()
+            self.turns += 1
+            self._check(value, recorded)
+            recorded.clear()
+
+    def _check(self, turnId, recorded):
+        self.checked += len(recorded)
+        if len(self._produced) == len(recorded):
+            # fields added since the log was recorded (e.g. outcome) are not compared
+            self._produced = [(key, {field: value[field] for field in old if field in value}) if key == oldKey else (key, value) for (key, value), (oldKey, old) in zip(self._produced, recorded)]
+        if self._produced != recorded:
+            self.mismatches.append({"turn": turnId, "recorded": list(recorded), "replayed": self._produced})
+
+    def run(self, events):
+        recorded = []
+        for _, key, value in events:
+            self.apply(key, value, recorded)
+        return self
+
+
+def replay(path, resolver="python", seed=None):
+    """Replay the log at `path`; return the Replay (turns, checked events, mismatches)."""
+    return Replay(resolver, seed).run(loadEvents(path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded game and check its damage and death events")
+    parser.add_argument("log", help="data.json or the basename of an event log (data)")
+    parser.add_argument("--resolver", default="python", choices=["python", "numpy"])
+    parser.add_argument("--seed", type=int, help="seed to use when the log has none")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    result = replay(args.log, args.resolver, args.seed)
+    elapsed = time.perf_counter() - start
+    print("%d turns, %d events checked in %.3fs" % (result.turns, result.checked, elapsed))
+    if not result._seeded:
+        print("no seed in the log: dodge rolls cannot be reproduced")
+    for mismatch in result.mismatches[:10]:
+        print("turn %s differs:\n  recorded %s\n  replayed %s" % (mismatch["turn"], mismatch["recorded"], mismatch["replayed"]))
+    if result.mismatches:
+        print("%d turns differ" % len(result.mismatches))
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,360 @@
+from action import *
+from array import array
+import random
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# action code of a character without action (or whose action was already reset)
+NO_ACTION = -1
+HIT = ACTION.HIT.value
+BLOCK = ACTION.BLOCK.value
+DODGE = ACTION.DODGE.value
+FLY = ACTION.FLY.value
+
+
+class NumpyResolver:
+    """Turn resolver working on struct-of-arrays NumPy buffers.
+
+    Everything that does not depend on the order of the attacks (speed
+    sort, target lookup, BLOCK reduction, DODGE rolls) is computed in
+    batch; only the application of the damages, which depends on who is
+    still alive, is done in speed order. Deaths, gold and damage events
+    are the same as with Engine.single_run for the same RNG state.
+    """
+
+    def __init__(self):
+        if np is None:
+            raise ImportError("numpy is required by the numpy resolver")
+
+    def resolve(self, arena, data, goldBook, rng, timings=None):
+        """Resolve one turn and return the (character, target) of the ones that flew away."""
+        players = list(arena.getPlayers())
+        n = len(players)
+        if n == 0:
+            return []
+        position = {}
+        for i in range(n):
+            position[players[i].getId()] = i
+
+        # struct of arrays, in the current arena order
+        speed = np.fromiter((c.getSpeed() for c in players), dtype=np.float64, count=n)
+        strength = np.fromiter((c.getStrength() for c in players), dtype=np.float64, count=n)
+        armor = np.fromiter((c.getArmor() for c in players), dtype=np.float64, count=n)
+        action = np.full(n, NO_ACTION, dtype=np.int64)
+        target = np.full(n, -1, dtype=np.int64)
+        for i in range(n):
+            cAction, cTarget = players[i].getAction()
+            if cAction is not None:
+                action[i] = cAction.value
+            if cTarget is not None:
+                target[i] = position.get(cTarget, -1)
+
+        # a stable sort on -speed gives the same order as list.sort(reverse=True)
+        sortStart = time.perf_counter()
+        order = np.argsort(-speed, kind="stable")
+        rank = np.empty(n, dtype=np.int64)
+        rank[order] = np.arange(n)
+        players = [players[i] for i in order.tolist()]
+        arena.setPlayersOrder(players)
+        speed = speed[order]
+        strength = strength[order]
+        armor = armor[order]
+        action = action[order]
+        target = target[order]
+        target = np.where(target >= 0, rank[np.maximum(target, 0)], -1)
+        if timings is not None:
+            timings["sort"] = time.perf_counter() - sortStart
+
+        # a target that already played had its action reset before being hit
+        hasTarget = target >= 0
+        safeTarget = np.where(hasTarget, target, 0)
+        tAction = np.where(hasTarget & (safeTarget > np.arange(n)), action[safeTarget], NO_ACTION)
+        tArmor = armor[safeTarget]
+        blockDamage = (1 - (tArmor / (tArmor + 8))) * strength
+        blockReduced = strength - blockDamage
+
+        # one roll per potential dodge; they are drawn in speed order like the scalar path
+        dead = [c.isDead() for c in players]
+        deadArray = np.array(dead, dtype=bool)
+        isHit = (action == HIT) & hasTarget & ~deadArray
+        dodgeCandidates = isHit & (tAction == DODGE) & ~deadArray[safeTarget]
+        nbRolls = int(np.count_nonzero(dodgeCandidates))
+        rngState = rng.getstate() if nbRolls else None
+        rolls = [rng.randint(0, 25) for _ in range(nbRolls)]
+
+        # apply the damages in speed order
+        life = [c.getLife() for c in players]
+        cStrengths = [c.getStrength() for c in players]
+        tSpeeds = speed[safeTarget].tolist()
+        actionList = action.tolist()
+        targetList = target.tolist()
+        tActionList = tAction.tolist()
+        blockDamageList = blockDamage.tolist()
+        blockReducedList = blockReduced.tolist()
+        damaged = set()
+        leavers = []
+        usedRolls = 0
+        for i in range(n):
+            if dead[i]:
+                continue
+            cAction = actionList[i]
+            t = targetList[i]
+            if cAction == HIT and t >= 0 and not dead[t]:
+                cStrength = cStrengths[i]
+                # a dodged attack does not touch the target's life (see setLife)
+                wounded = True
+                statistics = {}
+                statistics["character"] = players[i].getId()
+                statistics["target"] = players[t].getId()
+                if tActionList[i] == BLOCK:
+                    reducedDamages = blockDamageList[i]
+                    life[t] = life[t] - reducedDamages
+                    damaged.add(t)
+                    statistics["damage"] = reducedDamages
+                    statistics["reduced"] = blockReducedList[i]
+                    statistics["dodged"] = 0
+                    statistics["outcome"] = "blocked"
+                elif tActionList[i] == DODGE:
+                    r = rolls[usedRolls]
+                    usedRolls += 1
+                    statistics["damage"] = 0
+                    statistics["reduced"] = 0
+                    statistics["dodged"] = 0
+                    if r <= tSpeeds[i]:
+                        statistics["dodged"] = cStrength
+                        statistics["outcome"] = "dodged"
+                        wounded = False
+                    else:
+                        life[t] = life[t] - cStrength
+                        damaged.add(t)
+                        statistics["damage"] = cStrength
+                        statistics["outcome"] = "hit"
+                else:
+                    life[t] = life[t] - cStrength
+                    damaged.add(t)
+                    statistics["damage"] = cStrength
+                    statistics["reduced"] = 0
+                    statistics["dodged"] = 0
+                    statistics["outcome"] = "hit"
+                data.addData("damage", statistics)
+
+                if wounded and life[t] <= 0:
+                    dead[t] = True
+                    cId = players[i].getId()
+                    data.addData("death", {"character": players[t].getId(), "killer": cId})
+                    goldBook[cId] += 10
+                    data.addData("gold", {cId : goldBook[cId]})
+            elif cAction == FLY:
+                leavers.append((players[i], players[i].getAction()[1]))
+
+        # give back the rolls that were not needed, so the RNG stream stays
+        # the same as if they had been drawn one at a time
+        if usedRolls < nbRolls:
+            rng.setstate(rngState)
+            for _ in range(usedRolls):
+                rng.randint(0, 25)
+
+        # the actions are reset by Arena.endTurn()
+        arena.setLives([(players[t], life[t]) for t in damaged])
+        return leavers
+
+
+def _column(values):
+    # typed array when the column is homogeneous (compact to pickle), list otherwise
+    # so that ints stay ints and floats stay floats
+    if all(type(v) is int for v in values):
+        try:
+            return array("q", values)
+        except OverflowError:
+            return list(values)
+    if all(type(v) is float for v in values):
+        return array("d", values)
+    return list(values)
+
+
+def packArena(players):
+    """Compact columnar form of the characters, in the current arena order."""
+    position = {}
+    for i in range(len(players)):
+        position[players[i].getId()] = i
+    state = {
+        "speed": _column([c.getSpeed() for c in players]),
+        "strength": _column([c.getStrength() for c in players]),
+        "armor": _column([c.getArmor() for c in players]),
+        "life": _column([c.getLife() for c in players]),
+        "dead": array("b", [c.isDead() for c in players]),
+    }
+    state["action"], state["target"] = packActions(players, position)
+    return state
+
+
+def packActions(players, position):
+    """(action, target) columns of the characters; position maps a cid to its index."""
+    actions = []
+    targets = []
+    for character in players:
+        cAction, cTarget = character.getAction()
+        actions.append(NO_ACTION if cAction is None else cAction.value)
+        targets.append(position.get(cTarget, -1) if cTarget is not None else -1)
+    return array("b", actions), array("q", targets)
+
+
+def resolvePacked(state, rngState):
+    """Resolve one turn on a packed arena (see packArena), without any character object.
+
+    Runs in a worker process. Returns (order, lives, events, leavers, rngState):
+    the speed order as indexes of the packed arena (None if the arena is
+    already in that order), {index: new life} of the damaged characters, the
+    events in the order they happened, the indexes of the characters that
+    flew away, and the RNG state after the dodge rolls (None if no roll was
+    drawn).
+    """
+    speed = state["speed"]
+    strength = state["strength"]
+    armor = state["armor"]
+    life = list(state["life"])
+    dead = list(state["dead"])
+    action = list(state["action"])
+    target = state["target"]
+    # same order as list.sort(key=speed, reverse=True), which is stable
+    order = sorted(range(len(speed)), key=lambda i: -speed[i])
+    rng = None
+    lives = {}
+    events = []
+    leavers = []
+    for i in order:
+        if not dead[i]:
+            t = target[i]
+            if action[i] == HIT and t >= 0 and not dead[t]:
+                cStrength = strength[i]
+                if action[t] == BLOCK:
+                    reducedDamages = (1-(armor[t]/(armor[t]+8))) * cStrength
+                    life[t] = life[t] - reducedDamages
+                    lives[t] = life[t]
+                    events.append(("damage", i, t, reducedDamages, cStrength - reducedDamages, 0, "blocked"))
+                elif action[t] == DODGE:
+                    if rng is None:
+                        rng = random.Random()
+                        rng.setstate(rngState)
+                    if rng.randint(0, 25) <= speed[t]:
+                        events.append(("damage", i, t, 0, 0, cStrength, "dodged"))
+                    else:
+                        life[t] = life[t] - cStrength
+                        lives[t] = life[t]
+                        events.append(("damage", i, t, cStrength, 0, 0, "hit"))
+                else:
+                    life[t] = life[t] - cStrength
+                    lives[t] = life[t]
+                    events.append(("damage", i, t, cStrength, 0, 0, "hit"))
+                # same rule as CharacterProxy.setLife
+                if t in lives and life[t] <= 0:
+                    dead[t] = True
+                    events.append(("death", i, t))
+            elif action[i] == FLY:
+                leavers.append(i)
+        # a character that played has no action anymore when it is targeted
+        action[i] = NO_ACTION
+    if all(order[i] == i for i in range(len(order))):
+        # nothing to send back nor to reorder
+        order = None
+    return order, lives, events, leavers, rng.getstate() if rng is not None else None
+
+
+class PackedArena:
+    """Packed form of an arena kept between turns by a ProcessResolver.
+
+    The characteristic, life and dead columns are built once for a roster
+    and order; the lives are then updated from the turn results (only the
+    turns change them) and the columns follow the speed order, so that a
+    turn only packs the actions and targets again. It is built again when
+    a character joins, leaves or is replaced.
+    """
+
+    def __init__(self, arena, players):
+        self.arena = arena
+        self.players = players
+        self.position = {}
+        for i in range(len(players)):
+            self.position[players[i].getId()] = i
+        self.state = packArena(players)
+        # a list, so that a float can replace an int (and the types stay the ones of the characters)
+        self.state["life"] = list(self.state["life"])
+
+    def isValid(self, arena, players):
+        # same character objects in the same order (compared by identity)
+        return arena is self.arena and players == self.players
+
+    def pack(self):
+        """State for resolvePacked, with the current actions and targets."""
+        self.state["action"], self.state["target"] = packActions(self.players, self.position)
+        return self.state
+
+    def update(self, lives, order):
+        """Apply the results of resolvePacked: new lives, then the speed order."""
+        life = self.state["life"]
+        dead = self.state["dead"]
+        for t, tLife in lives.items():
+            life[t] = tLife
+            if tLife <= 0:
+                dead[t] = True
+        if order is None:
+            return
+        self.players = [self.players[i] for i in order]
+        for i in range(len(self.players)):
+            self.position[self.players[i].getId()] = i
+        for name in ("speed", "strength", "armor", "life", "dead"):
+            column = self.state[name]
+            reordered = [column[i] for i in order]
+            self.state[name] = array(column.typecode, reordered) if isinstance(column, array) else reordered
+
+
+class ProcessResolver:
+    """Turn resolver running resolvePacked in an executor, usually a
+    ProcessPoolExecutor shared by several arenas (see ArenaManager).
+
+    Only the packed arena goes to the worker and only the results come back;
+    they are applied here, so events, gold and the RNG stream are the same as
+    with Engine.single_run. What stays in this process is kept small: the
+    packed arena is kept between turns (PackedArena), the lives are set in
+    bulk (Arena.setLives) and the actions are reset by Arena.endTurn().
+    """
+
+    def __init__(self, executor):
+        self._executor = executor
+        self._packed = None
+
+    def resolve(self, arena, data, goldBook, rng, timings=None):
+        """Resolve one turn and return the (character, target) of the ones that flew away.
+
+        The sort is done by the worker, so its time is counted as combat."""
+        players = arena.getPlayers()
+        if not players:
+            return []
+        packed = self._packed
+        if packed is None or not packed.isValid(arena, players):
+            packed = self._packed = PackedArena(arena, list(players))
+        players = packed.players
+        order, lives, events, leavers, rngState = self._executor.submit(resolvePacked, packed.pack(), rng.getstate()).result()
+        if rngState is not None:
+            rng.setstate(rngState)
+
+        for event in events:
+            character = players[event[1]].getId()
+            target = players[event[2]].getId()
+            if event[0] == "damage":
+                data.addData("damage", {"character": character, "target": target, "damage": event[3], "reduced": event[4], "dodged": event[5], "outcome": event[6]})
+            else:
+                data.addData("death", {"character": target, "killer": character})
+                goldBook[character] += 10
+                data.addData("gold", {character : goldBook[character]})
+        arena.setLives([(players[t], tLife) for t, tLife in lives.items()])
+        # the actions are reset by Arena.endTurn()
+        leavers = [(players[i], players[i].getAction()[1]) for i in leavers]
+        packed.update(lives, order)
+        if order is not None:
+            arena.setPlayersOrder(packed.players)
+        return leavers
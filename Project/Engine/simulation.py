@@ -0,0 +1,208 @@
+"""Headless simulation: full games played in process, without HTTP.
+
+The characters are driven by Python policies instead of agents: each turn,
+every living character asks its team's policy for an action and a target
+(as SimpleAgent.choose_action/choose_target do), then the turn is resolved
+right away, with no characterTimeout wait and nothing persisted
+(Engine(persist=False)). A game ends when the living characters all belong
+to one team (the winner), when nobody is left, or after maxTurns.
+
+    python simulation.py --games 1000 --characters 10 --teams 2 --processes 4
+
+simulate() returns the win rate of each team and the turn count statistics.
+With processes, the games are spread over a process pool: the roster and
+the policies must then be picklable (module-level classes, no lambdas).
+"""
+from concurrent.futures import ProcessPoolExecutor
+from engine import *
+import argparse
+import json
+import random
+import time
+
+
+class RandomPolicy:
+    """Random action among `actions`, random enemy target (like SimpleAgent, without FLY)."""
+
+    def __init__(self, actions=(ACTION.HIT, ACTION.BLOCK, ACTION.DODGE)):
+        self._actions = tuple(actions)
+
+    def chooseAction(self, character, enemies, rng):
+        return rng.choice(self._actions)
+
+    def chooseTarget(self, character, enemies, rng):
+        return rng.choice(enemies).getId() if enemies else None
+
+
+class WeakestTargetPolicy(RandomPolicy):
+    """Always hits the living enemy with the lowest life."""
+
+    def __init__(self):
+        super().__init__((ACTION.HIT,))
+
+    def chooseTarget(self, character, enemies, rng):
+        return min(enemies, key=lambda enemy: enemy.getLife()).getId() if enemies else None
+
+
+# join rules of the API (ApiArena.validate_character)
+MAX_STAT_SUM = 20
+MAX_SPEED = 10
+
+
+def checkCharacter(character):
+    """Error message if a character dict breaks the join rules, None otherwise."""
+    total = character["life"] + character["strength"] + character["armor"] + character["speed"]
+    if total > MAX_STAT_SUM:
+        return "%s: stat sum %s > %d" % (character["cid"], total, MAX_STAT_SUM)
+    if character["speed"] > MAX_SPEED:
+        return "%s: speed %s > %d" % (character["cid"], character["speed"], MAX_SPEED)
+    return None
+
+
+class RandomRoster:
+    """Characters with random stats, dealt round-robin to the teams T0, T1...
+
+    Each stat is drawn uniformly from its (min, max) range; a character that
+    breaks the join rules (see checkCharacter) is drawn again.
+    """
+
+    def __init__(self, nbCharacters=10, nbTeams=2, life=(4, 12), strength=(1, 6), armor=(0, 5), speed=(0, 10)):
+        self.nbCharacters = nbCharacters
+        self.nbTeams = nbTeams
+        self.ranges = {"life": life, "strength": strength, "armor": armor, "speed": speed}
+        if sum(low for low, _ in self.ranges.values()) > MAX_STAT_SUM or speed[0] > MAX_SPEED:
+            raise ValueError("No character within these ranges can join a game")
+
+    def _draw(self, rng, cid, teamid):
+        while True:
+            character = {"cid": cid, "teamid": teamid}
+            for stat in ("life", "strength", "armor", "speed"):
+                character[stat] = rng.randint(*self.ranges[stat])
+            if checkCharacter(character) is None:
+                return character
+
+    def __call__(self, rng):
+        return [self._draw(rng, str(i), "T%d" % (i % self.nbTeams)) for i in range(self.nbCharacters)]
+
+
+def simulateGame(roster, policies, seed, maxTurns=1000, resolver="python"):
+    """Play one game and return {"seed", "winner", "turns", "survivors"}.
+
+    roster: list of character dicts (cid, teamid, life, strength, armor,
+    speed) or a callable rng -> list; policies: one policy for every team
+    or a dict teamid -> policy. winner is None on a draw or a timeout.
+    Raises ValueError if a character breaks the join rules.
+    """
+    rng = random.Random(seed)
+    if callable(roster):
+        roster = roster(rng)
+    for character in roster:
+        error = checkCharacter(character)
+        if error is not None:
+            raise ValueError("Character not allowed in a game: " + error)
+    # nobody reads the snapshots, the history or the turn results
+    engine = Engine(seed=rng.getrandbits(63), resolver=resolver, persist=False, historySize=1, statusTurns=1, recordTurns=False)
+    engine.addPlayers([CharacterProxy(c["cid"], c["teamid"], c["life"], c["strength"], c["armor"], c["speed"]) for c in roster], None)
+    engine.start()
+    characters = engine._arena.getPlayers()
+    winner = None
+    turns = 0
+    while True:
+        alive = [character for character in characters if not character.isDead() and engine._arena.hasPlayer(character.getId())]
+        teams = {character.getTeamId() for character in alive}
+        if len(teams) <= 1:
+            winner = teams.pop() if teams else None
+            break
+        if turns >= maxTurns:
+            break
+        for character in alive:
+            policy = policies.get(character.getTeamId()) if isinstance(policies, dict) else policies
+            enemies = [enemy for enemy in alive if enemy.getTeamId() != character.getTeamId()]
+            # set on the characters directly: no set_action events to log
+            character.setTarget(policy.chooseTarget(character, enemies, rng))
+            character.setAction(policy.chooseAction(character, enemies, rng))
+        engine.single_run()
+        turns += 1
+    engine.stop()
+    return {"seed": seed, "winner": winner, "turns": turns, "survivors": len(alive)}
+
+
+def _simulateGames(roster, policies, seeds, maxTurns, resolver):
+    # one chunk of games in a worker process
+    return [simulateGame(roster, policies, seed, maxTurns, resolver) for seed in seeds]
+
+
+def simulate(nbGames, roster=None, policies=None, seed=None, processes=None, maxTurns=1000, resolver="python", chunkSize=50):
+    """Play nbGames games and return the aggregate statistics (see summarize()).
+
+    The seed of each game is drawn from `seed`, so the same arguments give
+    the same results with or without processes.
+    """
+    roster = roster if roster is not None else RandomRoster()
+    policies = policies if policies is not None else RandomPolicy()
+    seedRng = random.Random(seed)
+    seeds = [seedRng.getrandbits(63) for _ in range(nbGames)]
+    start = time.perf_counter()
+    if processes:
+        chunks = [seeds[i:i + chunkSize] for i in range(0, nbGames, chunkSize)]
+        with ProcessPoolExecutor(processes) as pool:
+            futures = [pool.submit(_simulateGames, roster, policies, chunk, maxTurns, resolver) for chunk in chunks]
+            games = [game for future in futures for game in future.result()]
+    else:
+        games = _simulateGames(roster, policies, seeds, maxTurns, resolver)
+    stats = summarize(games, maxTurns)
+    stats["seconds"] = time.perf_counter() - start
+    return stats
+
+
+def summarize(games, maxTurns):
+    """Win rate per team, draws, timeouts and turn count statistics of games."""
+    wins = {}
+    draws = timeouts = 0
+    for game in games:
+        if game["winner"] is not None:
+            wins[game["winner"]] = wins.get(game["winner"], 0) + 1
+        elif game["turns"] >= maxTurns:
+            timeouts += 1
+        else:
+            draws += 1
+    turns = sorted(game["turns"] for game in games)
+    pick = lambda p: turns[min(len(turns) - 1, int(p * len(turns)))] if turns else None
+    return {
+        "games": len(games),
+        "wins": dict(sorted(wins.items())),
+        "win_rate": {team: count / len(games) for team, count in sorted(wins.items())},
+        "draws": draws,
+        "timeouts": timeouts,
+        "turns": {"mean": sum(turns) / len(turns) if turns else None, "min": pick(0), "p50": pick(0.5), "p90": pick(0.9), "max": turns[-1] if turns else None},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless arena simulation")
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--characters", type=int, default=10)
+    parser.add_argument("--teams", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--processes", type=int, help="size of the process pool (default: no pool)")
+    parser.add_argument("--max-turns", type=int, default=1000)
+    parser.add_argument("--resolver", default="python", choices=["python", "numpy"])
+    parser.add_argument("--weakest", action="append", default=[], metavar="TEAM", help="team playing WeakestTargetPolicy (repeatable)")
+    parser.add_argument("--json", help="write the statistics to this file")
+    args = parser.parse_args()
+
+    policies = {"T%d" % i: RandomPolicy() for i in range(args.teams)}
+    for team in args.weakest:
+        policies[team] = WeakestTargetPolicy()
+    stats = simulate(args.games, RandomRoster(args.characters, args.teams), policies, args.seed, args.processes, args.max_turns, args.resolver)
+    print("%d games in %.2fs (%.0f games/s)" % (stats["games"], stats["seconds"], stats["games"] / stats["seconds"]))
+    for team, rate in stats["win_rate"].items():
+        print("%-6s %6.1f%%" % (team, rate * 100))
+    print("draws %d, timeouts %d, turns %s" % (stats["draws"], stats["timeouts"], stats["turns"]))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(stats, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
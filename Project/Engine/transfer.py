@@ -0,0 +1,197 @@
+from concurrent.futures import ThreadPoolExecutor
+from logger import getLogger
+from requests.adapters import HTTPAdapter
+import random
+import requests
+import threading
+import time
+import uuid
+
+log = getLogger("transfer")
+
+# states of a transfer
+PREPARED = "prepared"
+COMMITTED = "committed"
+ABORTED = "aborted"
+
+
+class TransferLedger:
+    """Destination side of the server-to-server transfers (FLY).
+
+    A transfer is identified by the transfer id chosen by the source server,
+    which is also its idempotency key: preparing, committing or aborting the
+    same transfer twice gives the same answer and has no other effect.
+    prepare() reserves the cid, commit() adds the character exactly once.
+    A prepared transfer that is not committed within `ttl` seconds expires
+    and releases its cid; finished transfers are remembered for `keep`
+    seconds so that retried requests still get their answer.
+    """
+
+    def __init__(self, ttl=60, keep=3600):
+        self._ttl = ttl
+        self._keep = keep
+        self._lock = threading.Lock()
+        # transfer id -> {"state", "cid", "arena_id", "character", "gold", "ip", "time"}
+        self._transfers = {}
+        # cid -> transfer id of the prepared transfers
+        self._reserved = {}
+
+    def _expire(self, now):
+        for transferId, transfer in list(self._transfers.items()):
+            age = now - transfer["time"]
+            if transfer["state"] == PREPARED and age > self._ttl:
+                transfer["state"] = ABORTED
+                transfer["time"] = now
+                self._reserved.pop(transfer["cid"], None)
+                log.warning("transfer expired", extra={"fields": {"transfer": transferId, "cid": transfer["cid"]}})
+            elif transfer["state"] != PREPARED and age > self._keep:
+                del self._transfers[transferId]
+
+    def prepare(self, transferId, arenaId, character, gold, ip, isTaken):
+        """Reserve the cid of `character` (a dict), return the state of the transfer.
+
+        isTaken(arenaId, cid) tells whether the cid is already used in the arena;
+        the transfer is then refused and None is returned.
+        """
+        with self._lock:
+            now = time.time()
+            self._expire(now)
+            transfer = self._transfers.get(transferId)
+            if transfer is not None:
+                return transfer["state"]
+            cid = character["cid"]
+            if cid in self._reserved or isTaken(arenaId, cid):
+                return None
+            self._transfers[transferId] = {"state": PREPARED, "cid": cid, "arena_id": arenaId, "character": character, "gold": gold, "ip": ip, "time": now}
+            self._reserved[cid] = transferId
+            return PREPARED
+
+    def commit(self, transferId, apply):
+        """Call apply(transfer) once for a prepared transfer, return its state (None if unknown)."""
+        with self._lock:
+            self._expire(time.time())
+            transfer = self._transfers.get(transferId)
+            if transfer is None:
+                return None
+            if transfer["state"] == PREPARED:
+                # under the lock: a concurrent retry of the commit waits and sees COMMITTED
+                apply(transfer)
+                transfer["state"] = COMMITTED
+                transfer["time"] = time.time()
+                self._reserved.pop(transfer["cid"], None)
+            return transfer["state"]
+
+    def abort(self, transferId):
+        """Cancel a prepared transfer, return its state (None if unknown)."""
+        with self._lock:
+            transfer = self._transfers.get(transferId)
+            if transfer is None:
+                return None
+            if transfer["state"] == PREPARED:
+                transfer["state"] = ABORTED
+                transfer["time"] = time.time()
+                self._reserved.pop(transfer["cid"], None)
+            return transfer["state"]
+
+
+class TransferClient:
+    """Source side of the transfers: sends a character to another server.
+
+    The requests go through one requests.Session (kept-alive, pooled
+    connections per peer) and are retried with the same transfer id, so a
+    lost answer never adds the character twice. The outcome of the last
+    transfer of each cid is kept for getOutgoing() (agents use it to follow
+    their character).
+    """
+
+    def __init__(self, maxWorkers=4, poolSize=16, timeout=(2, 5), retries=3, ttl=60):
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=poolSize, pool_maxsize=poolSize, max_retries=0)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._timeout = timeout
+        self._retries = retries
+        # must not exceed the ttl of the destination ledger
+        self._ttl = ttl
+        self._executor = ThreadPoolExecutor(maxWorkers, thread_name_prefix="transfer")
+        # cid -> {"transfer_id", "destination", "arena_id", "state"}
+        self._outgoing = {}
+
+    def _post(self, url, payload):
+        """(status code, json body) of the request, or (None, None) if no answer was received."""
+        for attempt in range(self._retries):
+            try:
+                response = self._session.post(url, json=payload, timeout=self._timeout)
+                if response.status_code < 500:
+                    return response.status_code, response.json()
+            except Exception as e:
+                log.warning("transfer request failed", extra={"fields": {"url": url, "attempt": attempt + 1, "error": str(e)}})
+            # exponential backoff with jitter
+            time.sleep(random.uniform(0, 0.1 * 2 ** attempt))
+        return None, None
+
+    def send(self, character, gold, ip, destination, arenaId=None, onFailure=None):
+        """Transfer a character in the background, onFailure() is called if it did not move.
+
+        The outgoing record is created before returning, so getOutgoing()
+        shows the transfer as prepared as soon as the turn is published.
+        """
+        record = self._start(character, destination, arenaId)
+        return self._executor.submit(self._transfer, record, character, gold, ip, destination, arenaId, onFailure)
+
+    def transfer(self, character, gold, ip, destination, arenaId=None, onFailure=None):
+        """Prepare then commit the transfer of a character dict, return its final state."""
+        record = self._start(character, destination, arenaId)
+        return self._transfer(record, character, gold, ip, destination, arenaId, onFailure)
+
+    def _start(self, character, destination, arenaId):
+        record = {"transfer_id": uuid.uuid4().hex, "destination": destination, "arena_id": arenaId, "state": PREPARED}
+        self._outgoing[character["cid"]] = record
+        return record
+
+    def _transfer(self, record, character, gold, ip, destination, arenaId, onFailure):
+        transferId = record["transfer_id"]
+        cid = character["cid"]
+        payload = {"transfer_id": transferId, "arena_id": arenaId, "character": character, "gold": gold, "ip": ip}
+        deadline = time.time() + self._ttl
+
+        status, body = self._post(destination + "/transfer/prepare", payload)
+        if status != 200 or body.get("state") != PREPARED:
+            # refused or unreachable: abort in case the prepare went through
+            self._post(destination + "/transfer/abort", {"transfer_id": transferId})
+            return self._finish(record, ABORTED, onFailure)
+
+        # the commit decides; retry it until the destination answers
+        while True:
+            status, body = self._post(destination + "/transfer/commit", {"transfer_id": transferId})
+            if status is not None:
+                state = body.get("state") if status == 200 else ABORTED
+                return self._finish(record, state, onFailure)
+            if time.time() > deadline:
+                break
+            time.sleep(1)
+        # the prepared transfer expired on the destination, unless it was committed
+        status, body = self._post(destination + "/transfer/abort", {"transfer_id": transferId})
+        if status == 200:
+            return self._finish(record, body.get("state"), onFailure)
+        log.error("transfer in doubt", extra={"fields": {"transfer": transferId, "cid": cid, "destination": destination}})
+        record["state"] = None
+        return None
+
+    def _finish(self, record, state, onFailure):
+        record["state"] = state
+        log.info("transfer", extra={"fields": {"transfer": record["transfer_id"], "destination": record["destination"], "state": state}})
+        if state != COMMITTED and onFailure is not None:
+            onFailure()
+        return state
+
+    def getOutgoing(self, cid):
+        return self._outgoing.get(cid)
+
+    def forget(self, cid):
+        """Drop the record of the last transfer of a cid (new FLY, or the character is back)."""
+        self._outgoing.pop(cid, None)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self._session.close()
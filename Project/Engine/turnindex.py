@@ -0,0 +1,30 @@
+class TurnIndex:
+    """Index from turn id to the events of that turn.
+
+    It listens to Data (see Data.addListener): the indexed events are
+    gathered until the "turn_id" event closes the turn, so looking up a
+    turn never scans the log. Events received between two turns (a join,
+    a /leave) belong to the next turn. Only the last maxTurns turns are
+    kept, or all of them if maxTurns is None.
+    """
+
+    INDEXED_EVENTS = ("damage", "death", "gold", "leave_arena")
+
+    def __init__(self, maxTurns=None):
+        self._maxTurns = maxTurns
+        self._current = []
+        # turn id -> [{"type": key, "data": value}, ...], oldest turn first
+        self._turns = {}
+
+    def onEvent(self, key, value):
+        if key == "turn_id":
+            self._turns[value] = self._current
+            self._current = []
+            if self._maxTurns is not None and len(self._turns) > self._maxTurns:
+                del self._turns[next(iter(self._turns))]
+        elif key in self.INDEXED_EVENTS:
+            self._current.append({"type": key, "data": value})
+
+    def get(self, turnId):
+        """Events of a turn, or None if it is unknown or no longer kept."""
+        return self._turns.get(turnId)
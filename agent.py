@@ -9,6 +9,37 @@ class SimpleAgent:
         self.engine_url = engine_url
         self.available_urls = available_urls  # Liste des URLs fonctionnelles
         self.current_url = engine_url  # URL où l'agent est actuellement
+        self.snapshot = None  # Dernier état de l'arène reçu de /snapshot
+        self.etag = None
+        self.flying_to = None  # URL demandée par le dernier FLY, en attente du transfert
+        self.fly_round = None  # tour affiché quand le FLY a été envoyé
+
+    def get_snapshot(self, since=None):
+        """Récupère l'état de l'arène en une requête (tous les personnages et le numéro du tour).
+
+        Avec `since`, attend côté serveur la fin d'un tour plus récent (long-poll).
+        L'ETag évite de retélécharger un état inchangé.
+        """
+        params = {"since": since, "wait": 1} if since is not None else {}
+        headers = {"If-None-Match": self.etag} if self.etag else {}
+        try:
+            response = requests.get(f"{self.engine_url}/snapshot", params=params, headers=headers, timeout=65)
+            if response.status_code == 200:
+                self.snapshot = response.json()
+                self.etag = response.headers.get("ETag")
+                return self.snapshot
+            if response.status_code == 304:
+                return self.snapshot
+            print(f"Erreur lors de la récupération de l'état de l'arène : {response.text}")
+        except Exception as e:
+            print(f"Erreur lors de la récupération de l'état de l'arène : {e}")
+        return None
+
+    def get_characters_data(self):
+        """Personnages du dernier état reçu, indexés par ID."""
+        if self.snapshot is None:
+            return {}
+        return {character["cid"]: character for character in self.snapshot.get("arena", [])}
 
     def choose_action(self):
         """Choisir une action aléatoire pour l'instant."""
@@ -26,93 +57,97 @@ class SimpleAgent:
         return None
 
     def get_alive_characters(self, characters):
-        """Récupérer la liste des personnages vivants."""
+        """Récupérer la liste des personnages vivants (d'après le dernier état reçu)."""
+        characters_data = self.get_characters_data()
         alive_characters = []
         for character_id in characters:
-            try:
-                response = requests.get(f"{self.engine_url}/character/{character_id}")
-                if response.status_code == 200:
-                    character_data = response.json()
-                    if not character_data.get("dead", False):  # Si le personnage n'est pas mort
-                        alive_characters.append(character_id)
-                else:
-                    print(f"Erreur lors de la récupération des infos du personnage {character_id}: {response.text}")
-            except Exception as e:
-                print(f"Erreur pour vérifier si {character_id} est vivant : {e}")
+            character_data = characters_data.get(character_id)
+            if character_data is not None and not character_data.get("dead", False):  # Si le personnage n'est pas mort
+                alive_characters.append(character_id)
         return alive_characters
 
     def is_alive(self):
-        """Vérifie si l'agent est vivant en consultant l'API."""
-        try:
-            response = requests.get(f"{self.engine_url}/character/{self.cid}")
-            if response.status_code == 200:
-                character = response.json()
-                if character.get("dead", False):
-                    print(f"Agent {self.cid} est mort et ne peut pas jouer.")
-                    return False
-                return True
-            else:
-                return False
-        except Exception as e:
-            print(f"Erreur lors de la vérification de l'état de l'agent {self.cid}: {e}")
+        """Vérifie si l'agent est vivant d'après le dernier état reçu."""
+        character = self.get_characters_data().get(self.cid)
+        if character is None:
+            return False
+        if character.get("dead", False):
+            print(f"Agent {self.cid} est mort et ne peut pas jouer.")
             return False
+        return True
 
     def fly_to_another_url(self):
-        """Déplacer l'agent vers une autre URL."""
+        """Demander au serveur de déplacer l'agent vers une autre URL.
+
+        Le serveur transfère lui-même le personnage (avec son or) à la fin du
+        tour, en une seule opération : il n'est jamais dans les deux arènes,
+        et revient dans l'ancienne si le transfert échoue.
+        """
         # Choisir une nouvelle URL parmi les possibles
         new_url = random.choice(self.available_urls)
         print(f"L'agent {self.cid} tente de se déplacer de {self.engine_url} vers {new_url}")
 
         try:
-            # Récupérer les données de l'agent à l'URL actuelle
-            response = requests.get(f"{self.engine_url}/character/{self.cid}")
-            if response.status_code == 200:
-                agent_data = response.json()
-
-                # Tenter de rejoindre la nouvelle URL
-                join_response = requests.post(f"{new_url}/join", json=agent_data)
-                if join_response.status_code == 201:
-                    print(f"L'agent {self.cid} a rejoint la nouvelle URL {new_url}.")
-
-                    # Tenter de supprimer l'agent de l'ancienne URL
-                    delete_response = requests.delete(f"{self.engine_url}/leave",json={"cid": self.cid})
-                    print(self.available_urls)
-                    if delete_response.status_code == 200:
-                        print(f"L'agent {self.cid} a été supprimé de l'ancienne URL {self.engine_url}.")
-                        
-                        # Ajouter l'ancienne URL dans la liste des disponibles
-                        self.available_urls.append(self.engine_url)
-                        self.available_urls.remove(new_url)
-                        print(f"L'ancienne URL {self.engine_url} redevient disponible.")
-                        print(self.available_urls)
-                        # Mettre à jour l'URL actuelle
-                        self.engine_url = new_url
-                        print(f"Nouvelle URL actuelle pour l'agent {self.cid} : {self.engine_url}")
-
-                    else:
-                        print(f"Erreur lors de la suppression de l'agent {self.cid} sur {self.current_url}: {delete_response.text}")
-                        # Supprimer l'agent de la nouvelle URL pour éviter le dédoublement
-                        requests.delete(f"{new_url}/character/{self.cid}")
-                else:
-                    print(f"Erreur lors de l'ajout de l'agent {self.cid} sur la nouvelle URL {new_url}: {join_response.text}")
+            target_response = requests.post(f"{self.engine_url}/set_target", json={"cid": self.cid, "target_id": new_url})
+            action_response = requests.post(f"{self.engine_url}/set_action", json={"cid": self.cid, "action": "FLY"})
+            if target_response.status_code == 200 and action_response.status_code == 200:
+                self.flying_to = new_url
+                self.fly_round = self.snapshot["round"] if self.snapshot else 0
             else:
-                print(f"Impossible de récupérer les données de l'agent {self.cid} sur {self.current_url}: {response.text}")
+                print(f"Erreur lors du FLY de l'agent {self.cid} : {target_response.text} {action_response.text}")
         except Exception as e:
             print(f"Erreur lors du déplacement de l'agent {self.cid} : {e}")
 
-
-        
+    def follow_transfer(self):
+        """Après un FLY, suivre le personnage sur le serveur qui l'a accueilli."""
+        try:
+            response = requests.get(f"{self.engine_url}/transfer/{self.cid}")
+            if response.status_code == 404:
+                # Le FLY est joué au plus tard deux tours après son envoi, et le départ est
+                # enregistré avant la publication du tour : passé ce délai, pas de transfert
+                snapshot = self.get_snapshot()
+                if snapshot is not None and snapshot["round"] >= self.fly_round + 2:
+                    print(f"Aucun transfert pour l'agent {self.cid}, il n'a pas changé de serveur.")
+                    self.flying_to = None
+                return
+            if response.status_code != 200:
+                return
+            transfer = response.json()
+            if transfer["state"] == "committed":
+                new_url = transfer["destination"]
+                print(f"L'agent {self.cid} a rejoint la nouvelle URL {new_url}.")
+                # Ajouter l'ancienne URL dans la liste des disponibles
+                self.available_urls.append(self.engine_url)
+                if new_url in self.available_urls:
+                    self.available_urls.remove(new_url)
+                # Mettre à jour l'URL actuelle
+                self.engine_url = new_url
+                self.current_url = new_url
+                self.snapshot = None
+                self.etag = None
+                self.flying_to = None
+                print(f"Nouvelle URL actuelle pour l'agent {self.cid} : {self.engine_url}")
+            elif transfer["state"] == "aborted":
+                print(f"Le transfert de l'agent {self.cid} vers {transfer['destination']} a échoué, il reste sur {self.engine_url}.")
+                self.flying_to = None
+        except Exception as e:
+            print(f"Erreur lors du suivi du transfert de l'agent {self.cid} : {e}")
 
     def play_turn(self):
         """Envoyer l'action et la cible à l'API distante, si l'agent est vivant."""
+        if self.flying_to is not None:
+            self.follow_transfer()
+            if self.flying_to is not None:
+                return  # Transfert encore en cours
+        if self.snapshot is None:
+            self.get_snapshot()
         if not self.is_alive():
             return  # Si l'agent est mort, ne pas jouer
 
         try:
-            # Récupérer la liste des personnages disponibles
-            response = requests.get(f"{self.engine_url}/characters")
-            if response.status_code == 200:
-                characters = response.json().get("characters", [])
+            # Liste des personnages disponibles, d'après le dernier état reçu
+            if self.snapshot is not None:
+                characters = list(self.get_characters_data())
                 if self.cid in characters:
                     characters.remove(self.cid)  # Ne pas cibler soi-même
 
@@ -155,7 +190,13 @@ class SimpleAgent:
         """Exécuter les tours pour l'agent."""
         while True:
             self.play_turn()
-            time.sleep(5)  # Temps d'attente avant le prochain tour
+            if self.flying_to is not None:
+                # Le transfert se termine juste après la fin du tour
+                time.sleep(0.5)
+                continue
+            # Attendre la fin du tour côté serveur plutôt que dormir un temps fixe
+            if self.snapshot is None or self.get_snapshot(since=self.snapshot["round"]) is None:
+                time.sleep(5)
 
 
 def start_agents_for_available_characters(engine_url, available_urls):
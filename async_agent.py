@@ -0,0 +1,220 @@
+import asyncio
+import random
+import sys
+
+import aiohttp
+
+
+class HttpClient:
+    """Client HTTP partagé par tous les agents d'un processus.
+
+    Une seule session aiohttp : les connexions sont gardées ouvertes
+    (keep-alive) et réutilisées, au plus `limit` au total et `limit_per_host`
+    par serveur. Les erreurs réseau et les réponses 5xx sont retentées avec
+    un délai exponentiel aléatoire (jitter) pour ne pas relancer tous les
+    agents en même temps.
+    """
+
+    def __init__(self, limit=1000, limit_per_host=32, timeout=10, retries=3, backoff=0.2):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.session = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host, keepalive_timeout=60)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+
+    async def request(self, method, url, timeout=None, **kwargs):
+        """Renvoie (code HTTP, corps JSON ou None, en-têtes), ou (None, None, None) après les essais."""
+        if timeout is not None:
+            kwargs["timeout"] = aiohttp.ClientTimeout(total=timeout)
+        for attempt in range(self.retries):
+            try:
+                async with self.session.request(method, url, **kwargs) as response:
+                    if response.status < 500:
+                        body = None
+                        if response.status != 304:
+                            body = await response.json(content_type=None)
+                        return response.status, body, response.headers
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f"Erreur pour {method} {url} (essai {attempt + 1}) : {e!r}")
+            # délai exponentiel avec jitter ("full jitter")
+            await asyncio.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+        return None, None, None
+
+
+class AsyncAgent:
+    """Décisions d'un personnage ; les requêtes sont faites par son HostRunner."""
+
+    def __init__(self, cid, available_urls):
+        self.cid = cid
+        self.available_urls = available_urls  # URLs vers lesquelles FLY peut aller
+        self.flying_to = None  # URL demandée par le dernier FLY, en attente du transfert
+        self.fly_round = None  # tour affiché quand le FLY a été envoyé
+
+    def choose_action(self):
+        """Choisir une action aléatoire pour l'instant."""
+        actions = ["DODGE", "HIT", "BLOCK"]
+        if self.available_urls:
+            actions.append("FLY")
+        return random.choice(actions)
+
+    def choose_target(self, alive_characters):
+        """Choisir une cible aléatoire parmi les personnages vivants (sauf soi-même)."""
+        targets = [cid for cid in alive_characters if cid != self.cid]
+        if not targets:
+            return None
+        return random.choice(targets)
+
+
+class HostRunner:
+    """Fait jouer tous les agents présents sur un même serveur.
+
+    Un seul /snapshot (long-poll, ETag) par tour pour tous les agents, puis un
+    seul /batch/set_action avec l'action et la cible de chacun, au lieu de
+    plusieurs requêtes et d'un thread par personnage.
+    """
+
+    def __init__(self, client, url, runners):
+        self.client = client
+        self.url = url
+        self.runners = runners  # URL -> HostRunner, pour suivre les agents qui changent de serveur
+        self.agents = {}
+        self.snapshot = None
+        self.etag = None
+
+    def add_agent(self, agent):
+        self.agents[agent.cid] = agent
+
+    async def get_snapshot(self, since=None):
+        params = {"since": since, "wait": 1} if since is not None else {}
+        headers = {"If-None-Match": self.etag} if self.etag else {}
+        status, body, response_headers = await self.client.request("GET", f"{self.url}/snapshot", params=params, headers=headers, timeout=65)
+        if status == 200:
+            self.snapshot = body
+            self.etag = response_headers.get("ETag")
+        elif status != 304:
+            print(f"Erreur lors de la récupération de l'état de {self.url} : {status} {body}")
+            return None
+        return self.snapshot
+
+    async def play_turn(self):
+        """Envoyer en une requête les actions de tous les agents vivants de ce serveur."""
+        characters = {c["cid"]: c for c in self.snapshot.get("arena", [])}
+        alive = [cid for cid, c in characters.items() if not c.get("dead", False)]
+        if self.snapshot.get("round", 0) > 0 and len(alive) <= 1:
+            # fin de la partie : il reste au plus un personnage
+            print(f"Partie terminée sur {self.url}, vainqueur : {alive}")
+            self.agents.clear()
+            return
+        actions = []
+        for agent in list(self.agents.values()):
+            character = characters.get(agent.cid)
+            if agent.flying_to is not None:
+                continue
+            if character is None or character.get("dead", False):
+                # mort ou parti : l'agent s'arrête
+                del self.agents[agent.cid]
+                continue
+            action = agent.choose_action()
+            if action == "FLY":
+                agent.flying_to = random.choice(agent.available_urls)
+                agent.fly_round = self.snapshot.get("round", 0)
+                target = agent.flying_to
+            else:
+                target = agent.choose_target(alive)
+                if target is None:
+                    continue
+            actions.append({"cid": agent.cid, "action": action, "target_id": target})
+
+        # tout ou rien : on renvoie sans les éléments refusés (cible partie entre-temps...)
+        while actions:
+            status, body, _ = await self.client.request("POST", f"{self.url}/batch/set_action", json={"actions": actions})
+            if status == 200 or body is None or "results" not in body:
+                break
+            refused = {r["cid"] for r in body["results"] if r["status"] != 200}
+            for cid in refused:
+                agent = self.agents.get(cid)
+                if agent is not None:
+                    agent.flying_to = None
+            actions = [a for a in actions if a["cid"] not in refused]
+
+    async def follow_transfers(self):
+        """Après un FLY, suivre chaque personnage sur le serveur qui l'a accueilli."""
+        flying = [agent for agent in self.agents.values() if agent.flying_to is not None]
+        responses = await asyncio.gather(*(self.client.request("GET", f"{self.url}/transfer/{agent.cid}") for agent in flying))
+        for agent, (status, transfer, _) in zip(flying, responses):
+            if status == 404:
+                # Le FLY est joué au plus tard deux tours après son envoi (un tour s'il
+                # arrive avant la résolution), et le départ est enregistré avant la
+                # publication du tour : avant ce délai, le transfert n'a pas encore commencé
+                if self.snapshot["round"] >= agent.fly_round + 2:
+                    # aucun transfert : le personnage est resté ou a simplement quitté l'arène
+                    agent.flying_to = None
+                continue
+            if status != 200 or transfer["state"] == "prepared":
+                continue
+            agent.flying_to = None
+            if transfer["state"] == "committed":
+                del self.agents[agent.cid]
+                new_url = transfer["destination"]
+                # l'ancienne URL redevient disponible pour cet agent
+                agent.available_urls = [u for u in agent.available_urls if u != new_url] + [self.url]
+                runner = self.runners.get(new_url)
+                if runner is None:
+                    runner = self.runners[new_url] = HostRunner(self.client, new_url, self.runners)
+                    runner.task = asyncio.ensure_future(runner.run())
+                runner.add_agent(agent)
+                print(f"L'agent {agent.cid} a rejoint la nouvelle URL {new_url}.")
+
+    async def run(self):
+        since = None
+        while self.agents:
+            if await self.get_snapshot(since) is None:
+                await asyncio.sleep(random.uniform(1, 2))
+                continue
+            if since is not None and self.snapshot["round"] == since:
+                # long-poll expiré sans nouveau tour
+                continue
+            since = self.snapshot["round"]
+            await self.follow_transfers()
+            await self.play_turn()
+        self.runners.pop(self.url, None)
+
+
+async def run_agents(engine_url, available_urls, client=None):
+    """Faire jouer un agent par personnage présent sur engine_url, jusqu'à la fin de la partie."""
+    if client is None:
+        async with HttpClient() as client:
+            return await run_agents(engine_url, available_urls, client)
+    status, body, _ = await client.request("GET", f"{engine_url}/characters")
+    if status != 200:
+        print(f"Erreur lors de la récupération des personnages : {status} {body}")
+        return
+    characters = body.get("characters", [])
+    if not characters:
+        print("Aucun personnage disponible dans l'arène.")
+        return
+    print(f"Personnages disponibles : {len(characters)}")
+
+    runners = {}
+    runner = runners[engine_url] = HostRunner(client, engine_url, runners)
+    for cid in characters:
+        runner.add_agent(AsyncAgent(cid, [u for u in available_urls if u != engine_url]))
+    runner.task = asyncio.ensure_future(runner.run())
+    # attendre tous les serveurs, y compris ceux rejoints en cours de partie
+    while runners:
+        await asyncio.gather(*(r.task for r in list(runners.values())))
+
+
+if __name__ == "__main__":
+    # usage : python async_agent.py http://10.109.111.12:5000 [http://10.109.111.11:5000 ...]
+    engine_url = sys.argv[1] if len(sys.argv) > 1 else "http://127.0.0.1:5000"
+    asyncio.run(run_agents(engine_url, sys.argv[2:]))